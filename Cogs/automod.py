@@ -1,11 +1,13 @@
 import discord
 
-from utils import db, commands, objects
+from utils import commands, objects
 from utils.checks import *
-import re
+from utils.matchers import DomainIndex
 import asyncio
 import inspect
-import yarl
+import logging
+
+logger = logging.getLogger("discord.automod")
 
 
 def setup(bot):
@@ -62,53 +64,61 @@ class automodCog(commands.Cog):
     async def cog_check(self, ctx):
         return await basic_check(ctx, "editor") and check_module("automod")
 
+    async def settings_changed(self, ctx):
+        """
+        called after anything the raid mode snapshot covers is changed.
+        restoring the pre-raid settings would undo the change in memory, but not in the database
+        """
+        amod = self.bot.get_cog("AModExec")
+        if amod is not None and amod.end_raid(ctx.guild.id):
+            await ctx.send("Raid mode was active, the settings from before the raid won't be restored automatically anymore")
+
     @commands.Cog.listener()
     async def on_ready(self):
         if self.bot.automod_states:
             return
 
-        conn = await self.bot.pg.acquire()
-        data = await conn.fetch("SELECT * FROM automod;")
-        ignore = await conn.fetch("SELECT * FROM automod_ignore;")
-        words = await conn.fetch("SELECT * FROM automod_triggers;")
-        await self.bot.pg.release(conn)
+        async with self.bot.pg.acquire() as conn:
+            data = await conn.fetch("SELECT * FROM automod;")
+            ignore = await conn.fetch("SELECT guild_id, type, array_agg(id) AS ids FROM automod_ignore GROUP BY guild_id, type;")
+            words = await conn.fetch("SELECT guild_id, type, array_agg(word) AS words FROM automod_triggers GROUP BY guild_id, type;")
+
+        words = {(rec['guild_id'], rec['type']): rec['words'] for rec in words}
+        ignore = {(rec['guild_id'], rec['type']): rec['ids'] for rec in ignore}
 
         for record in data:
-            self.states[record['guild_id']] = objects.AutomodLevels(record['flags'],
-                                                                    record['raidmode'],
-                                                                    self.bot.get_channel(record['channel']),
-                                                                    record['default_wordlist'],
-                                                                    None,
-                                                                    record['caps_percent'])
-
-            _words = []
-            for rec in words:
-                await asyncio.sleep(0)
-                if rec['guild_id'] == record['guild_id'] and rec['type'] is 1:
-                    _words.append(rec['word'])
-
-            _links = []
-            for rec in words:
-                await asyncio.sleep(0)
-                if rec['guild_id'] == record['guild_id'] and rec['type'] is 2:
-                    _links.append(rec['word'])
-
-            self.states[record['guild_id']].blacklisted_links = _links
-
-            self.states[record['guild_id']].regex = re.compile((
-                      r'(?i)'  # case insensitive
-                      r'\b'  # word bound
-                      r'(?:{})'  # non capturing group, to make sure that the word bound occurs before/after all words
-                      r'\b'
-                      ).format('|'.join(map(re.escape, _words))))
-
-            for ignore_rec in ignore:
-                await asyncio.sleep(0)
-                if ignore_rec['guild_id'] == record['guild_id']:
-                    if ignore_rec['type'] == 1:
-                        self.states[record['guild_id']].ignored_channels.append(ignore_rec['id'])
-                    else:
-                        self.states[record['guild_id']].ignores_roles.append(ignore_rec['id'])
+            gid = record['guild_id']
+            try:
+                state = objects.AutomodLevels(record['flags'],
+                                              record['raidmode'],
+                                              record['channel'],
+                                              record['default_wordlist'],
+                                              [w for w in words.get((gid, 1)) or () if w],
+                                              record['caps_percent'],
+                                              ignore.get((gid, 1)),
+                                              ignore.get((gid, 2)))
+
+                state.blacklisted_links = self.load_links(gid, words.get((gid, 2)) or ())
+            except Exception:
+                # one guild's bad config shouldn't leave every other guild without automod
+                logger.exception(f"failed to load the automod config of guild {gid}")
+            else:
+                self.states[gid] = state
+
+            await asyncio.sleep(0) # building the word filters is cpu bound, so give other tasks a chance between guilds
+
+    def load_links(self, guild_id, entries):
+        links = DomainIndex()
+        for entry in entries:
+            if not entry:
+                continue
+
+            try:
+                links.add(entry)
+            except ValueError:
+                logger.warning(f"skipping invalid link entry {entry!r} of guild {guild_id}")
+
+        return links
 
 
     @commands.group(invoke_without_command=True, usage="[subcommands]", walk_help=False)
@@ -161,6 +171,7 @@ class automodCog(commands.Cog):
                                       f" WHERE guild_id = {ctx.guild.id}; DELETE FROM automod_ignore WHERE guild_id = {ctx.guild.id}")
             self.states[ctx.guild.id] = state = objects.AutomodLevels.none()
             await self.bot.pg.execute("INSERT INTO automod VALUES ($1,$2,$3,$4,$5,$6);", ctx.guild.id, *state.save())
+            await self.settings_changed(ctx)
             await ctx.send("reset automod to defaults")
 
     @automod.command(hidden=True, usage="<relaxed/strict>", aliases=['presets'])
@@ -178,8 +189,25 @@ class automodCog(commands.Cog):
             state.raidmode_strict()
 
         await self.bot.pg.execute("UPDATE automod SET flags = $1, raidmode = $2, channel = $3, caps_percent=$4, default_wordlist = $5 WHERE guild_id = $6;", *state.save(), ctx.guild.id)
+        await self.settings_changed(ctx)
         await ctx.send(f"automod has now been set to the following:\n{PRESET_RELAXED_FMT if mode == 'relaxed' else PRESET_STRICT_FMT}")
 
+    @automod.command("raidmode", usage="[on/off]")
+    @check_configured()
+    async def am_raidmode(self, ctx, enabled: bool = None):
+        """
+        switches automod to the strict preset when a lot of people (or new accounts) join at once,
+        and back to the previous settings once the joins stop. off by default
+        """
+        state = self.states[ctx.guild.id]
+        if enabled is None:
+            return await ctx.send(f"Automatic raid mode is {'on' if state.auto_raidmode else 'off'}")
+
+        state.auto_raidmode = int(enabled)
+        await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", state.value, ctx.guild.id)
+        await self.settings_changed(ctx)
+        await ctx.send(f"Automatic raid mode has been turned {'on' if enabled else 'off'}")
+
     @automod.group(invoke_without_command=True, usage="[channel/'remove']")
     @check_configured()
     async def channel(self, ctx, channel: discord.TextChannel=None):
@@ -231,6 +259,7 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].spam = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Spam punishment has been set to {'off' if level == 0 else level}")
 
     @automod.group("profanity", invoke_without_command=True, usage="[level]")
@@ -260,6 +289,7 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].words = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Profanity punishment has been set to {'off' if level == 0 else level}")
 
     @am_bw.command("defaults", usage="<on/off>")
@@ -268,6 +298,7 @@ class automodCog(commands.Cog):
         state = self.states[ctx.guild.id]
         state.default_filter = enabled
         await self.bot.pg.execute("UPDATE automod SET default_wordlist = $1 WHERE guild_id = $2", enabled, ctx.guild.id)
+        await self.settings_changed(ctx)
         await ctx.send("Now using default word list" if enabled else "No longer using default word list")
 
     @am_bw.command("add", usage="<word>")
@@ -276,15 +307,11 @@ class automodCog(commands.Cog):
         """
         add a word to trigger the automod
         """
+        if word in self.states[ctx.guild.id].bad_words:
+            return await ctx.send(f"{word} is already blacklisted")
+
         await self.bot.pg.execute("INSERT INTO automod_triggers VALUES ($1, 1, $2);", ctx.guild.id, word)
-        self.states[ctx.guild.id].bad_words.append(word)
-        v = re.compile((
-                           r'(?i)'  # case insensitive
-                           r'\b'  # word bound
-                           r'(?:{})'  # non capturing group, to make sure that the word bound occurs before/after all words
-                           r'\b'
-                       ).format('|'.join(map(re.escape, [a[0] for a in self.states[ctx.guild.id].bad_words]))))
-        self.states[ctx.guild.id].regex = v
+        self.states[ctx.guild.id].bad_words.add(word)
         await ctx.send(f"{ctx.author.mention} --> added {word} to blacklisted words")
 
     @am_bw.command("remove", usage="<word>")
@@ -296,13 +323,6 @@ class automodCog(commands.Cog):
         if word in self.states[ctx.guild.id].bad_words:
             await self.bot.pg.execute(f"DELETE FROM automod_triggers WHERE guild_id = $1 AND word = $2 and type=1;", ctx.guild.id, word)
             self.states[ctx.guild.id].bad_words.remove(word)
-            v = re.compile((
-                               r'(?i)'  # case insensitive
-                               r'\b'  # word bound
-                               r'(?:{})'  # non capturing group, to make sure that the word bound occurs before/after all words
-                               r'\b'
-                           ).format('|'.join(map(re.escape, [a[0] for a in self.states[ctx.guild.id].bad_words]))))
-            self.states[ctx.guild.id].regex = v
             await ctx.send(f"{ctx.author.mention} --> removed `{word}` from blacklisted words.")
         else:
             await ctx.send(f"{word} is not blacklisted")
@@ -330,6 +350,7 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].mass_mentions = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Mass mentions punishment has been set to {'off' if level == 0 else level}")
 
     @am_mm.command("amount", usage="<amount>")
@@ -341,6 +362,7 @@ class automodCog(commands.Cog):
         self.states[ctx.guild.id].mass_mentions_amount = num
         val = self.states[ctx.guild.id].value
         await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+        await self.settings_changed(ctx)
         await ctx.send(f"Mass mentions threshold has been set to {num}")
     
     @automod.group("caps", invoke_without_command=True, usage="[level]")
@@ -361,6 +383,7 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].caps = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Caps punishment has been set to {'off' if level == 0 else level}")
 
     @am_ac.command("percent", usage="<number: 1-100>")
@@ -392,32 +415,65 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].links = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Links punishment has been set to {'off' if level == 0 else level}")
 
     @am_sl.command("add", usage="<domain>")
     @check_configured()
     async def am_sl_add(self, ctx, url):
-        url = yarl.URL(url).host
-        state = self.states[ctx.guild.id]
+        """
+        blacklists a domain, and all of its subdomains.
+        use `*.domain.com` to only blacklist the subdomains
+        """
+        entry = DomainIndex.parse(url)
+        if entry is None or entry.startswith("!"):
+            return await ctx.send("That isn't a valid domain")
 
-        if url in state.blacklisted_links:
+        state = self.states[ctx.guild.id]
+        if entry in state.blacklisted_links:
             return await ctx.send("This domain is already blacklisted")
 
-        await self.bot.pg.execute("INSERT INTO automod_triggers VALUES ($1,2,$2)", ctx.guild.id, url)
-        state.blacklisted_links.append(url)
-        await ctx.send(f"the domain <{url}> is now blacklisted")
+        await self.bot.pg.execute("INSERT INTO automod_triggers VALUES ($1,2,$2)", ctx.guild.id, entry)
+        state.blacklisted_links.add(entry)
+        await ctx.send(f"the domain <{entry}> is now blacklisted")
+
+    @am_sl.command("allow", usage="<domain>")
+    @check_configured()
+    async def am_sl_allow(self, ctx, url):
+        """
+        allows a domain (and its subdomains), even if a parent domain is blacklisted.
+        ex. `automod links add example.com` then `automod links allow cdn.example.com`
+        """
+        entry = DomainIndex.parse(url)
+        if entry is None:
+            return await ctx.send("That isn't a valid domain")
+
+        if not entry.startswith("!"):
+            entry = "!" + entry
+
+        state = self.states[ctx.guild.id]
+        if entry in state.blacklisted_links:
+            return await ctx.send("This domain is already allowed")
+
+        await self.bot.pg.execute("INSERT INTO automod_triggers VALUES ($1,2,$2)", ctx.guild.id, entry)
+        state.blacklisted_links.add(entry)
+        await ctx.send(f"the domain <{entry[1:]}> is now allowed")
 
     @am_sl.command("remove", usage="<domain>")
+    @check_configured()
     async def am_sl_remove(self, ctx, url):
-        url = url.replace("http://", "").replace("https://", "").replace("www.", "").split("/")[0]
+        """
+        removes a blacklisted (or allowed, with `!domain.com`) domain
+        """
+        entry = DomainIndex.parse(url)
         state = self.states[ctx.guild.id]
 
-        if url not in state.blacklisted_links:
+        if entry is None or entry not in state.blacklisted_links:
             return await ctx.send("This domain is not blacklisted")
 
-        await self.bot.pg.execute("DELETE FROM automod_triggers WHERE guild_id = $1 AND word = $2 AND type = 2", ctx.guild.id, url)
-        state.blacklisted_links.remove(url)
-        await ctx.send(f"the domain <{url}> is no longer blacklisted")
+        await self.bot.pg.execute("DELETE FROM automod_triggers WHERE guild_id = $1 AND word = $2 AND type = 2", ctx.guild.id, entry)
+        state.blacklisted_links.remove(entry)
+        await ctx.send(f"the domain <{entry}> is no longer blacklisted")
 
     @automod.group("invites", invoke_without_command=True, usage="[level]")
     async def am_sdi(self, ctx, level: AutomodLevelConverter=None):
@@ -436,6 +492,7 @@ class automodCog(commands.Cog):
             self.states[ctx.guild.id].invites = level
             val = self.states[ctx.guild.id].value
             await self.bot.pg.execute("UPDATE automod SET flags = $1 WHERE guild_id = $2", val, ctx.guild.id)
+            await self.settings_changed(ctx)
             await ctx.send(f"Invites punishment has been set to {'off' if level == 0 else level}")
 
     @automod.group("ignored", invoke_without_command=True)
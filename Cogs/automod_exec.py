@@ -1,71 +1,209 @@
 import re
 import datetime
+import string
+import time
 import discord
-from utils import commands, objects
-import yarl
-
-CAPS = re.compile(r"[ABCDEFGHIJKLMNOPQRSTUVWXYZ]")
-LINKS = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+")
+from discord.ext import tasks
+from utils import caches, commands, objects
+from utils.matchers import WordFilter, canonicalize, scan_window, url_host
+from utils.batching import Batcher
+from utils.trackers import SpamTracker, JoinTracker
+
+CAPS = str.maketrans("", "", string.ascii_uppercase) # deletes caps, the difference in length is the amount of caps
+# a single character class (the same characters the old alternation allowed), so it can't backtrack
+LINKS = re.compile(r"https?://[!$-_a-z]+")
 INVITE = re.compile(r"(?:https?://)?discord(?:app\.com/invite|\.gg)/?[a-zA-Z0-9]+/?")
-CHARS_MAPPING = {
-    "a": ("a", "@", "*", "4"),
-    "i": ("i", "*", "l", "1"),
-    "o": ("o", "*", "0", "@"),
-    "u": ("u", "*", "v"),
-    "v": ("v", "*", "u"),
-    "l": ("l", "1"),
-    "e": ("e", "*", "3"),
-    "s": ("s", "$", "5"),
-}
-
-def apply_mapping(words: list):
-    ret = []
-    ret2 = []
-    for word in words:
-        reps = [c for c in CHARS_MAPPING if c in word]
-        if reps:
-            for char in reps:
-                for rep in CHARS_MAPPING[char]:
-                    ret.append(word.replace(char, rep))
-                    ret2.append(f" {word.replace(char, rep)} ")
-
-        ret.append(word)
-        ret2.append(f" {word} ")
-
-    return ret, ret2
-
 with open("data/default_wordlist.txt") as f:
-    badwords, ms_badwords = apply_mapping(f.read().splitlines())
-    badwords_tup = tuple(badwords)
+    # built once at load. its size only depends on the word list, not on how many lookalikes there are
+    default_filter = WordFilter(f.read().splitlines())
 
 def setup(bot):
     bot.add_cog(AModExec(bot))
 
+class MessageFeatures:
+    """
+    everything the automod rules look at, pulled out of a message in one go.
+    features for rules that the guild has turned off are skipped.
+    `word_limit` caps how much of the message the banned words look at, once RuleBudget has degraded that rule.
+    """
+    __slots__ = ("content", "length", "caps", "mentions", "links", "hosts", "invite", "text", "runs", "cost")
+
+    def __init__(self, message: commands.Message, state: objects.AutomodLevels, word_limit: int = None):
+        content = self.content = message.content
+        self.length = len(content)
+        self.mentions = len(message.mentions)
+        self.caps = 0
+        self.links = self.hosts = ()
+        self.invite = None
+        self.text, self.runs = "", []
+        # how long the expensive features took, by the rule they're for. counts against that rule's budget
+        self.cost = {}
+        clock = time.perf_counter
+
+        if state.caps:
+            self.caps = self.length - len(content.translate(CAPS))
+
+        # the substring checks and regexes run in C, so links and invites always look at the whole message.
+        # the substring checks let most messages skip the regexes entirely
+        if state.links and "://" in content:
+            start = clock()
+            self.links = LINKS.findall(content)
+            # a link the regex matched isn't necessarily one yarl can parse, those just don't get a host
+            self.hosts = [host for host in map(url_host, self.links) if host]
+            self.cost["run_allow_links"] = clock() - start
+
+        if state.invites and "discord" in content:
+            start = clock()
+            self.invite = INVITE.search(content)
+            self.cost["run_allow_discord_invites"] = clock() - start
+
+        if state.words and (state.default_filter or state.bad_words):
+            start = clock()
+            # canonicalizing and matching run in python, this is the one feature that's cut short when it's too slow
+            self.text, self.runs = canonicalize(scan_window(content, word_limit))
+            self.cost["run_banned_words"] = clock() - start
+
+class Punishment:
+    __slots__ = ("message", "reason", "level", "delete", "purge", "notify")
+
+    def __init__(self, message, reason, level, delete, purge, notify):
+        self.message = message
+        self.reason = reason
+        self.level = level # 0 is just deleting, 1 mutes, 2 kicks, 3 bans
+        self.delete = delete
+        self.purge = purge
+        self.notify = notify
+
+class PunishedUser:
+    """
+    everything one user did wrong within a batch, merged together
+    """
+    __slots__ = ("message", "member", "level", "reasons", "results", "notify", "emoji")
+
+    def __init__(self, message):
+        self.message = message
+        self.member = message.author
+        self.level = 0
+        self.reasons = []
+        self.results = []
+        self.notify = None
+        self.emoji = "<:messagedelete:684549889182531604>"
+
 class AModExec(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.states = bot.automod_states
-        self.long_cooldown = commands.CooldownMapping(commands.Cooldown(25, 15, commands.BucketType.channel))
-        self.short_cooldown = commands.CooldownMapping.from_cooldown(8, 4, commands.BucketType.channel)
+        # per user, so a busy channel full of people talking doesn't get one of them purged
+        self.spam = SpamTracker(rules=((8, 4), (25, 15)), duplicates=(4, 30))
+        self.joins = JoinTracker(amount=10, per=10, young_amount=5, young_per=60)
+        # guild id: [settings from before the raid, when the last raid join happened]
+        self.raids = {}
+        self.raid_cooldown = 600
+        # raids mean hundreds of offenders at once, so punishments go out in batches per guild.
+        # discord.py waits out the route rate limits, the batches just keep the amount of requests down
+        self.punishments = Batcher(self.flush_punishments, delay=1.5, max_items=200, concurrency=3, loop=bot.loop)
+        # (guild id, user id): (level, when), so one user isn't muted over and over within the window
+        self.punished = {}
+        self.punish_window = 60
+        self.evict_idle.start()
+        bot.pipeline.add("automod", self.on_message, priority=30, ordered=True)
+
+    def cog_unload(self):
+        self.bot.pipeline.remove("automod")
+        self.evict_idle.cancel()
+        self.bot.loop.create_task(self.punishments.close())
+
+    @tasks.loop(minutes=1)
+    async def evict_idle(self):
+        self.spam.evict()
+        self.joins.evict()
+        self.bot.rule_budget.evict()
+
+        now = time.monotonic()
+        for key in [key for key, (_, when) in self.punished.items() if now - when >= self.punish_window]:
+            del self.punished[key]
+
+        for guild_id, (snapshot, last) in list(self.raids.items()):
+            if now - last < self.raid_cooldown:
+                continue
+
+            del self.raids[guild_id]
+            state = self.states.get(guild_id)
+            if state is None:
+                continue
+
+            state.restore(snapshot)
+            embed = commands.Embed(title="Raid mode", colour=discord.Color.green(), timestamp=datetime.datetime.utcnow())
+            embed.description = f"No raid joins in the last {self.raid_cooldown // 60} minutes, automod settings have been restored."
+            await self.send_to_guild_log_channel(guild_id, embed)
+
+    def end_raid(self, guild_id: int) -> bool:
+        """
+        forgets about a raid without restoring the settings from before it. returns False if there wasn't one
+        """
+        return self.raids.pop(guild_id, None) is not None
 
     @commands.Cog.listener()
-    async def on_message(self, message: commands.Message):
-        if not self.bot.setup or not self.states:
-            return 1
+    async def on_member_join(self, member: commands.Member):
+        if not self.bot.setup or member.guild.id not in self.states:
+            return
 
-        if not message.guild or (not
-                message.guild.me.guild_permissions.manage_messages and not
-                message.guild.me.guild_permissions.administrator):
-            return 2
+        if not self.states[member.guild.id].auto_raidmode:
+            # opt in, a busy server can see plenty of joins without being raided
+            return
+
+        now = time.monotonic()
+        age = (datetime.datetime.utcnow() - member.created_at).total_seconds()
+        reason = self.joins.hit(member, age, now)
+
+        raid = self.raids.get(member.guild.id)
+        if raid is not None:
+            # every join that still looks like part of the raid pushes the cooldown back
+            if reason is not None:
+                raid[1] = now
+            return
+
+        if reason is None:
+            return
+
+        state = self.states[member.guild.id]
+        if state.raidmode == 2:
+            # already strict because someone set it that way, so there's nothing to switch back later
+            return
+
+        self.raids[member.guild.id] = [state.snapshot(), now]
+        state.raidmode_strict()
 
-        if message.guild.id not in self.states:
-            return 3
+        histogram = self.joins.histogram(member.guild.id, now=now)
+        labels = ("< 1 hour", "< 1 day", "< 1 week", "< 1 month", "older")
+        embed = commands.Embed(title="Raid mode", colour=discord.Color.red(), timestamp=datetime.datetime.utcnow())
+        embed.description = f"{reason}, switching to strict raid mode."
+        embed.add_field(name="Account ages of recent joins",
+                        value="\n".join(f"{label}: {count}" for label, count in zip(labels, histogram)))
+        await self.send_to_guild_log_channel(member.guild.id, embed)
 
-        if self.ignored(message, self.states[message.guild.id]):
-            return 4
+    async def on_message(self, ctx):
+        state = ctx.automod_state
+        if state is None:
+            return
+
+        message = ctx.message
+        if (not message.guild.me.guild_permissions.manage_messages and not
+                message.guild.me.guild_permissions.administrator):
+            return
 
-        for coro in self.tests.copy():
-            if await coro(self, message, self.states[message.guild.id]):
+        if self.ignored(message, state):
+            return
+
+        budget = self.bot.rule_budget
+        gid = message.guild.id
+        features = MessageFeatures(message, state, budget.scan_length(gid, "run_banned_words"))
+        for coro in self.tests:
+            name = coro.__name__
+            start = time.perf_counter()
+            triggered = await coro(self, message, features, state)
+            budget.record(gid, name, time.perf_counter() - start + features.cost.get(name, 0))
+            if triggered:
                 return True
 
 
@@ -82,146 +220,87 @@ class AModExec(commands.Cog):
 
         return False
 
-    async def run_banned_words(self, message, state: objects.AutomodLevels):
-        content = message.content.lower()
+    async def run_banned_words(self, message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.words
         if punishment == 0:
             return False
 
-        found = False
+        found = None
 
         if state.default_filter:
-            if content.startswith(badwords_tup):
-                found = True
-
-            elif content.endswith(badwords_tup):
-                found = True
+            found = default_filter.match(features.text, features.runs)
 
-            else:
-                found = any([True for i in ms_badwords if i.lower() in content])
-
-
-        if state.regex is not None and state.bad_words:
-            if not found and state.regex.search(content):
-                found = True
-
-            elif not found and content.startswith(tuple(state.bad_words)):
-                found = True
-
-        if found:
-            embed = self.create_embed(message)
-            msg, emoji = await self.do_punishment(message, delete=punishment>=1, mute=punishment>=2, kick=punishment>=3, ban=punishment>=4)
-            embed.description = f"{emoji}\n{msg}"
-            embed.add_field(name="Reason", value=f"**Bad Words:**\n{message.content}")
-            await self.send_to_log_channel(message, embed)
-            try:
-                await message.author.send(f"You can't say that in {message.guild.name}")
-            except:
-                pass
+        if found is None and state.bad_words:
+            found = state.bad_words.match(features.text, features.runs)
 
+        if found is not None:
+            self.punish(message, f"**Bad Words:** (matched `{found[2]}`)\n{message.content}", punishment,
+                        notify=f"You can't say that in {message.guild.name}")
             return True
 
         return False
 
-    async def run_message_spam(self, message, state: objects.AutomodLevels):
+    async def run_message_spam(self, message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.spam
         if punishment == 0:
             return
 
-        triggered = False
-        reason = ""
-        purge_amount = 0
-
-        if self.long_cooldown.update_rate_limit(message):
-            triggered = True
-            reason = "Sent 25 messages in 15 seconds"
-            purge_amount = 25
-            self.long_cooldown.get_bucket(message).reset()
-
-        if self.short_cooldown.update_rate_limit(message):
-            triggered = True
-            reason = "Sent 8 messages in 4 seconds"
-            purge_amount = 8
-            self.short_cooldown.get_bucket(message).reset()
-
+        triggered = self.spam.hit(message)
         if triggered:
-            e = self.create_embed(message)
-            fmt, emoji = await self.do_punishment(message, purge=True, purge_amount=purge_amount, ban=punishment>=4, kick=punishment>=3, mute=punishment>=2)
-            e.description = f"{emoji}\n{fmt}"
-            e.add_field(name="Reason", value=reason)
-            await self.send_to_log_channel(message, embed=e)
+            reason, purge_amount = triggered
+            self.punish(message, reason, punishment, delete=False, purge=purge_amount)
             return True
 
         return False
 
-    async def run_mass_mentions(self, message: commands.Message, state: objects.AutomodLevels):
+    async def run_mass_mentions(self, message: commands.Message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.mass_mentions
         maxmentions = state.mass_mentions_amount
         if punishment == 0:
             return
 
-        if len(message.mentions) > maxmentions:
-            fmt, emoji = await self.do_punishment(message, delete=True, mute=punishment>=2, kick=punishment>=3, ban=punishment>=4)
-            embed = self.create_embed(message)
-            embed.description = f"{emoji}\n{fmt}"
-            embed.add_field(name="Reason", value=f"Mentioned {len(message.mentions)} members in one message")
-            await self.send_to_log_channel(message, embed)
+        if features.mentions > maxmentions:
+            self.punish(message, f"Mentioned {features.mentions} members in one message", punishment)
             return True
 
         return False
 
 
-    async def run_all_caps(self, message, state: objects.AutomodLevels):
+    async def run_all_caps(self, message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.caps
         percent = state.caps_percent
         if punishment == 0:
             return
 
-        v = CAPS.findall(message.content)
-        if len(v) >= len(message.content)*(percent/100) and len(message.content) > 5:
-            fmt, emoji = await self.do_punishment(message, delete=True, mute=punishment>=2, kick=punishment>=3, ban=punishment>=4)
-            embed = self.create_embed(message)
-            embed.description = f"{emoji}\n{fmt}"
-            embed.add_field(name="Reason", value=f"Message with {round(len(v)/len(message.content)*100)}% caps")
-            await self.send_to_log_channel(message, embed)
+        if features.caps >= features.length*(percent/100) and features.length > 5:
+            self.punish(message, f"Message with {round(features.caps/features.length*100)}% caps", punishment)
             return True
 
         return False
 
 
-    async def run_allow_links(self, message, state: objects.AutomodLevels):
+    async def run_allow_links(self, message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.links
         if punishment == 0:
             return
 
-        links = LINKS.findall(message.content)
-
-        if links:
-            links = [yarl.URL(link).host for link in links]
-
-            for link in links:
-                if link in state.blacklisted_links:
-                    fmt, emoji = await self.do_punishment(message, delete=True, mute=punishment>=2, kick=punishment>=3, ban=punishment>=4)
-                    embed = self.create_embed(message)
-                    embed.description = f"{emoji}\n{fmt}"
-                    embed.add_field(name="Reason", value=f"Blacklisted Link:\n{message.content}")
-                    await self.send_to_log_channel(message, embed)
+        if features.hosts and state.blacklisted_links:
+            for host in features.hosts:
+                found = state.blacklisted_links.search(host)
+                if found is not None:
+                    self.punish(message, f"Blacklisted Link: (matched `{found}`)\n{message.content}", punishment)
                     return True
 
         return False
 
 
-    async def run_allow_discord_invites(self, message, state: objects.AutomodLevels):
+    async def run_allow_discord_invites(self, message, features: MessageFeatures, state: objects.AutomodLevels):
         punishment = state.invites
         if punishment == 0:
             return
 
-        if INVITE.search(message.content):
-            fmt, emoji = await self.do_punishment(message, delete=True, mute=punishment>=2, kick=punishment>=3, ban=punishment>=4)
-            embed = self.create_embed(message)
-            embed.description = f"{emoji}\n{fmt}"
-            embed.add_field(name="Reason", value=f"Server Invite:\n{message.content}")
-            await self.send_to_log_channel(message, embed)
+        if features.invite:
+            self.punish(message, f"Server Invite:\n{message.content}", punishment)
             return True
 
         return False
@@ -237,83 +316,188 @@ class AModExec(commands.Cog):
         return emb
 
     async def send_to_log_channel(self, message, embed):
-        channel = self.states[message.guild.id].channel
+        await self.send_to_guild_log_channel(message.guild.id, embed)
+
+    async def send_to_guild_log_channel(self, guild_id, embed):
+        channel = self.states[guild_id].channel
         channel = self.bot.get_channel(channel)
         if channel is None:
             return
 
         await channel.send(embed=embed)
 
-    async def do_mute(self, target: commands.Member, until=None):
-        role = target.guild.get_role(self.bot.guild_role_states[target.guild.id]['muted'])
-        if not role:
-            await self.bot.pg.execute("INSERT INTO moddata VALUES ($1,$2,$3,$4,$5)", target.guild.id, target.id,
-                                      self.bot.user.id,
-                                      "Automod: Failed to mute user (no mute role set up)", datetime.datetime.utcnow())
-            return False
-        try:
-            await target.add_roles(role, reason=f"Automod muted user")
-        except commands.HTTPException:
-            await self.bot.pg.execute("INSERT INTO moddata VALUES ($1,$2,$3,$4,$5)", target.guild.id, target.id, self.bot.user.id,
-                                  "Automod: Failed to mute user (missing manage roles permission)", datetime.datetime.utcnow())
-            return False
+    def punish(self, message, reason: str, punishment: int, delete=True, purge: int=0, notify: str=None):
+        """
+        queues a punishment. `punishment` is the rule's level: 2 mutes, 3 kicks, 4 bans.
+        the actual api calls are made by `flush_punishments`, a batch at a time per guild
+        """
+        self.punishments.add(message.guild.id, Punishment(message, reason, punishment - 1, delete, purge, notify))
 
-        await self.bot.pg.execute("INSERT INTO moddata VALUES ($1,$2,$3,$4,$5)", target.guild.id, target.id, self.bot.user.id,
-                                  "Automod: User Muted", datetime.datetime.utcnow())
-        await self.bot.pg.execute("INSERT INTO mutes VALUES ($1,$2,$3);", target.guild.id, target.id, until)
-        return True
+    async def flush_punishments(self, guild_id, items):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or guild_id not in self.states:
+            return
 
-    async def do_punishment(self, message, delete=False, purge=False, purge_amount: int=None, mute=False, mute_until: int=None, kick=False, ban=False):
-        ret = ""
-        emoji = ""
-        if delete:
+        now = time.monotonic()
+        deletes = {} # channel: set of message ids
+        purges = {} # channel: {author id: how many messages to look through}
+        users = {} # user id: PunishedUser
+        for item in items:
+            message = item.message
+            if item.delete:
+                deletes.setdefault(message.channel, set()).add(message.id)
+
+            if item.purge:
+                authors = purges.setdefault(message.channel, {})
+                authors[message.author.id] = max(authors.get(message.author.id, 0), item.purge)
+
+            user = users.get(message.author.id)
+            if user is None:
+                user = users[message.author.id] = PunishedUser(message)
+
+            user.level = max(user.level, item.level)
+            user.notify = user.notify or item.notify
+            if item.reason not in user.reasons:
+                user.reasons.append(item.reason)
+
+        for channel, authors in purges.items():
+            found = deletes.setdefault(channel, set())
+            indexed = [self.bot.message_index.search(channel.id, limit, author_id=author) for author, limit in authors.items()]
+            if None not in indexed:
+                for ids in indexed:
+                    found.update(ids)
+                continue
+
+            # the index doesn't go back far enough, one history scan per channel covers every spammer in it
             try:
-                await message.delete()
-                self.bot.logging_ignore.append(message.id)
+                async for message in channel.history(limit=max(authors.values())):
+                    if message.author.id in authors:
+                        found.add(message.id)
             except discord.HTTPException:
-                ret += "Failed to delete message (missing permissions or already deleted)\n"
-
-            else:
-                ret += "Message deleted\n"
-                emoji = "<:messagedelete:684549889182531604>"
-
-        if mute and not (kick or ban):
-            if await self.do_mute(message.author, mute_until):
-                ret += "User Muted\n"
-                emoji = "\U0001f507"
-            else:
-                ret += "Failed to mute user\n"
-
-        if purge:
+                for user in users.values():
+                    if user.message.channel == channel and user.message.author.id in authors:
+                        user.results.append("Failed to purge user's messages")
+
+        deleted = failed = 0
+        for channel, ids in deletes.items():
+            recent, old = caches.split_by_age(sorted(ids))
+            # messages too old to bulk delete go one at a time
+            chunks = [recent[i:i+100] for i in range(0, len(recent), 100)] + [[x] for x in old]
+            for chunk in chunks:
+                try:
+                    if len(chunk) == 1:
+                        await channel.get_partial_message(chunk[0]).delete()
+                    else:
+                        await channel.delete_messages([discord.Object(id=x) for x in chunk])
+                except discord.HTTPException:
+                    failed += len(chunk)
+                else:
+                    deleted += len(chunk)
+                    if len(chunk) == 1:
+                        # single deletes show up as a normal delete event, bulk deletes are logged as one summary
+                        self.bot.logging_ignore.append(chunk[0])
+
+        moddata = []
+        mutes = []
+        for user in users.values():
+            key = guild_id, user.member.id
+            previous = self.punished.get(key)
+            if previous is not None and now - previous[1] < self.punish_window and previous[0] >= user.level:
+                # already got this (or worse) recently, don't stack another mute on top
+                user.results.append("Already punished recently")
+                continue
+
+            if user.level:
+                self.punished[key] = user.level, now
+
+            await self.apply_punishment(guild, user, moddata, mutes)
+
+            if user.notify:
+                try:
+                    await user.member.send(user.notify)
+                except discord.HTTPException:
+                    pass
+
+        for row in moddata:
+            self.bot.writer.put_nowait("moddata", row)
+        if mutes:
+            await self.bot.pg.executemany("INSERT INTO mutes VALUES ($1,$2,$3);", mutes)
+
+        await self.send_to_guild_log_channel(guild_id, self.summary_embed(users, deleted, failed))
+
+    async def apply_punishment(self, guild, user, moddata: list, mutes: list):
+        member = user.member
+        if user.level >= 3:
             try:
-                await message.channel.purge(limit=purge_amount, check=lambda m: m.author.id == message.author.id)
-            except commands.HTTPException:
-                ret += "Failed to purge user's messages\n"
+                await guild.ban(member, reason="Automod")
+            except discord.HTTPException:
+                user.results.append("Failed to ban user")
             else:
-                ret += "Purged user's messages\n"
+                user.results.append("Banned User")
+                user.emoji = "<:bancreate:684549908211957787>"
 
-        if kick and not ban:
+        elif user.level == 2:
             try:
-                await message.guild.kick(message.author, reason="Automod")
+                await guild.kick(member, reason="Automod")
             except discord.HTTPException:
-                ret += "Failed to kick user\n"
+                user.results.append("Failed to kick user")
             else:
-                ret += "User Kicked\n"
-                emoji = "<:memberleave:684549880425087032>"
+                user.results.append("User Kicked")
+                user.emoji = "<:memberleave:684549880425087032>"
 
-        if ban:
-            try:
-                await message.author.ban(reason="Automod")
-            except commands.HTTPException:
-                ret += "Failed to ban user\n"
+        elif user.level == 1:
+            if await self.do_mute(member, moddata, mutes):
+                user.results.append("User Muted")
+                user.emoji = "\U0001f507"
             else:
-                ret += "Banned User\n"
-                emoji = "<:bancreate:684549908211957787>"
+                user.results.append("Failed to mute user")
+
+    async def do_mute(self, target: commands.Member, moddata: list, mutes: list, until=None):
+        now = datetime.datetime.utcnow()
+        role = target.guild.get_role(self.bot.guild_configs[target.guild.id].muted)
+        if not role:
+            moddata.append((target.guild.id, target.id, self.bot.user.id, "Automod: Failed to mute user (no mute role set up)", now))
+            return False
+        try:
+            await target.add_roles(role, reason=f"Automod muted user")
+        except commands.HTTPException:
+            moddata.append((target.guild.id, target.id, self.bot.user.id, "Automod: Failed to mute user (missing manage roles permission)", now))
+            return False
 
-        return ret, emoji
+        moddata.append((target.guild.id, target.id, self.bot.user.id, "Automod: User Muted", now))
+        mutes.append((target.guild.id, target.id, until))
+        return True
 
-    tests = [
-        run_all_caps, run_allow_discord_invites, run_allow_links, run_banned_words,
-        run_mass_mentions, run_mass_mentions, run_message_spam
-    ]
+    def summary_embed(self, users: dict, deleted: int, failed: int):
+        if len(users) == 1:
+            user, = users.values()
+            embed = self.create_embed(user.message)
+            embed.description = "\n".join([user.emoji, *user.results, self.deleted_line(deleted, failed)])
+            embed.add_field(name="Reason", value="\n".join(user.reasons)[:1024])
+            return embed
+
+        embed = commands.Embed(title="Automod", colour=discord.Color.red(), timestamp=datetime.datetime.utcnow())
+        embed.description = f"<:messagedelete:684549889182531604>\n{len(users)} users punished\n{self.deleted_line(deleted, failed)}"
+        for user in list(users.values())[:24]:
+            value = "\n".join(user.results + user.reasons)
+            embed.add_field(name=f"{user.member} ({user.member.id})", value=value[:1024] or "\u200b", inline=False)
+
+        if len(users) > 24:
+            embed.add_field(name="\u200b", value=f"and {len(users) - 24} more", inline=False)
+
+        return embed
+
+    @staticmethod
+    def deleted_line(deleted: int, failed: int):
+        line = f"{deleted} message{'s' if deleted != 1 else ''} deleted"
+        if failed:
+            line += f", failed to delete {failed} (missing permissions or already deleted)"
+        return line
+
+    # cheapest checks first, the first one to trigger stops the rest.
+    # spam stays last, as it is the only rule with side effects (the rate limit buckets)
+    tests = (
+        run_mass_mentions, run_all_caps, run_allow_discord_invites, run_allow_links,
+        run_banned_words, run_message_spam
+    )
 
@@ -87,6 +87,10 @@ class cah(commands.Cog):
         self.games = {}  # we are not storing games in a database. fuck that.
         self.users_in_games = {}  # to ensure users are only in one game at a time
         self.spam_bucket = commands.CooldownMapping.from_cooldown(1,2,commands.BucketType.user)
+        bot.pipeline.add("cah", self.on_message, dms=True)
+
+    def cog_unload(self):
+        self.bot.pipeline.remove("cah")
 
     def cog_check(self, ctx):
         if ctx.guild is None:
@@ -99,11 +103,11 @@ class cah(commands.Cog):
         embed.set_footer(text=f"CAH game id: {game['id']}")
         return embed
 
-    @commands.Cog.listener()
-    async def on_message(self, msg):
-        if msg.guild is not None or msg.author.id not in self.users_in_games:
+    async def on_message(self, ctx):
+        msg = ctx.message
+        if not ctx.is_dm or msg.author.id not in self.users_in_games:
             return
-        if (await self.bot.get_context(msg)).command is not None:
+        if (await self.bot.get_context(msg, prefix=ctx.prefix)).command is not None:
             return
         if self.spam_bucket.update_rate_limit(msg):
             await msg.author.send("You are sending messages too quickly")
@@ -193,7 +193,7 @@ class community(commands.Cog):
         if req is None:
             await self.db.execute("INSERT INTO giveaway_settings VALUES (?,3000,0,0)", ctx.guild.id)
             raise errors.ModuleDisabled("giveaway")
-        enabled = self.bot.guild_module_states[ctx.guild.id]['giveaway']
+        enabled = self.bot.guild_configs[ctx.guild.id].has_module('giveaway')
         if not enabled:
             return
         points = pointscog.cache[ctx.guild.id][ctx.author.id]['points']
@@ -53,7 +53,7 @@ class settings(commands.Cog):
         """
         if module is None:
             p = ""
-            for a, b in self.bot.guild_module_states[ctx.guild.id].items():
+            for a, b in self.bot.guild_configs[ctx.guild.id].module_states().items():
                 if b:
                     p += f"<:GreenTick:609893073216077825> - {a}\n"
                 else:
@@ -68,17 +68,21 @@ class settings(commands.Cog):
                 if state is None:
                     raise commands.MissingRequiredArgument("state")
 
-                self.bot.guild_module_states[ctx.guild.id] = {x: state for x in self.bot.guild_module_states[ctx.guild.id]}
-                await self.bot.pg.execute("UPDATE modules SET flags = $1 WHERE guild_id = $2", objects.save_modules({}, state), ctx.guild.id)
+                config = self.bot.update_config(ctx.guild.id, modules=objects.ALL_MODULES if state else 0)
+                await self.bot.pg.execute("UPDATE modules SET flags = $1 WHERE guild_id = $2", objects.flags_from_modules(config.modules), ctx.guild.id)
                 return await ctx.send(f"toggled all modules to {state}")
 
-            if module.lower() not in self.bot.guild_module_states[ctx.guild.id]:
+            module = module.lower()
+            if module not in objects.MODULES:
                 return await ctx.send("Unknown Module: "+module)
 
-            self.bot.guild_module_states[ctx.guild.id][module] = state
-            states = objects.save_modules(self.bot.guild_module_states[ctx.guild.id])
-            await self.bot.pg.execute("UPDATE modules SET flags = $1 WHERE guild_id = $2", states, ctx.guild.id)
-            await ctx.send(f"toggled {module} to state {self.bot.guild_module_states[ctx.guild.id][module]}")
+            if state is None:
+                raise commands.MissingRequiredArgument("state")
+
+            config = self.bot.guild_configs[ctx.guild.id]
+            config = self.bot.update_config(ctx.guild.id, modules=config.module_mask(module, state))
+            await self.bot.pg.execute("UPDATE modules SET flags = $1 WHERE guild_id = $2", objects.flags_from_modules(config.modules), ctx.guild.id)
+            await ctx.send(f"toggled {module} to state {config.has_module(module)}")
 
     @commands.group(invoke_without_command=True, usage="[config to assign] ...", aliases=['role'])
     async def roles(self, ctx):
@@ -92,10 +96,7 @@ class settings(commands.Cog):
             `manager` - Allows usage of Community Commands
         """
         roles = []
-        for a,b in self.bot.guild_role_states[ctx.guild.id].items():
-            if a == "streamer":
-                continue
-
+        for a,b in self.bot.guild_configs[ctx.guild.id].roles().items():
             r = ctx.guild.get_role(b)
             if r:
                 r = f"{r.mention} - {r.name}"
@@ -110,7 +111,7 @@ class settings(commands.Cog):
         requires the `Bot Editor` role or higher
         """
         await self.bot.pg.execute("UPDATE roles SET editor = $1 WHERE guild_id = $2", role.id, ctx.guild.id)
-        self.bot.guild_role_states[ctx.guild.id]['editor'] = role.id
+        self.bot.update_config(ctx.guild.id, editor=role.id)
         e = discord.Embed(color=discord.Color.teal())
         e.title = "Assigned `Bot Editor` role:"
         e.description = role.mention + " "
@@ -124,7 +125,7 @@ class settings(commands.Cog):
         requires the `Bot Editor` role or higher
         """
         await self.bot.pg.execute("UPDATE roles SET muted = $1 WHERE guild_id = $2", role.id, ctx.guild.id)
-        self.bot.guild_role_states[ctx.guild.id]['muted'] = role.id
+        self.bot.update_config(ctx.guild.id, muted=role.id)
         e = discord.Embed(color=discord.Color.teal())
         e.title = "Assigned `Muted` role:"
         e.description = role.mention
@@ -138,7 +139,7 @@ class settings(commands.Cog):
         requires the `Bot Editor` role or higher
         """
         await self.bot.pg.execute("UPDATE roles SET moderator = $1 WHERE guild_id = $2", role.id, ctx.guild.id)
-        self.bot.guild_role_states[ctx.guild.id]['moderator'] = role.id
+        self.bot.update_config(ctx.guild.id, moderator=role.id)
         e = discord.Embed(color=discord.Color.teal())
         e.title = "Assigned `Moderator` role:"
         e.description = role.mention
@@ -152,7 +153,7 @@ class settings(commands.Cog):
         requires the `Bot Editor` role or higher
         """
         await self.bot.pg.execute("UPDATE roles SET manager = $1 WHERE guild_id = $2", role.id, ctx.guild.id)
-        self.bot.guild_role_states[ctx.guild.id]['manager'] = role.id
+        self.bot.update_config(ctx.guild.id, manager=role.id)
         e = discord.Embed(color=discord.Color.teal())
         e.title = "Assigned `Community Manager` role:"
         e.description = role.mention
@@ -176,7 +177,8 @@ class settings(commands.Cog):
         adds a prefix to your server!
         """
         await self.bot.pg.execute("INSERT INTO prefixes VALUES ($1,$2)", ctx.guild.id, prefix)
-        self.bot.guild_prefixes[ctx.guild.id].append(prefix)
+        config = self.bot.guild_configs[ctx.guild.id]
+        self.bot.update_config(ctx.guild.id, prefixes=(*config.prefixes, prefix))
         await ctx.send(f"{prefix} is now a prefix")
 
     @c_pref.command("remove")
@@ -186,11 +188,11 @@ class settings(commands.Cog):
         removes a prefix from your server!
         """
 
-        try:
-            self.bot.guild_prefixes[ctx.guild.id].remove(prefix)
-        except:
+        config = self.bot.guild_configs[ctx.guild.id]
+        if prefix not in config.prefixes:
             await ctx.send(f"could not remove `{prefix}`, as it did not exist (you cannot remove the mention prefix)")
             return
+        self.bot.update_config(ctx.guild.id, prefixes=tuple(p for p in config.prefixes if p != prefix))
         pref = await self.bot.pg.fetchrow("DELETE FROM prefixes WHERE guild_id = $1 AND prefix = $2 RETURNING *;",
                                           ctx.guild.id, prefix)
         if pref:
@@ -26,13 +26,14 @@ class BasicCurrency(commands.Cog, name="Currency2"):
         self.bot = bot
         self.activities = commands.CooldownMapping.from_cooldown(5, 300, commands.BucketType.member)
         self.activity_loop.start()
+        bot.pipeline.add("activity", self.on_message, priority=10)
 
     def cog_unload(self):
+        self.bot.pipeline.remove("activity")
         self.activity_loop.cancel()
 
-    @commands.Cog.listener()
-    async def on_message(self, msg):
-        self.activities.update_rate_limit(msg)
+    async def on_message(self, ctx):
+        self.activities.update_rate_limit(ctx.message)
 
     @tasks.loop(minutes=5)
     async def activity_loop(self):
@@ -41,8 +42,8 @@ class BasicCurrency(commands.Cog, name="Currency2"):
         for key, bucket in self.activities._cache.items():
             if bucket._tokens <= 0:
                 local_edits.append((key[0], key[1]))
-        if local_edits:
-            await self.bot.pg.executemany("INSERT INTO talking_stats VALUES ($1,$2,1) ON CONFLICT (guild_id, user_id) DO UPDATE SET messages = talking_stats.messages + 1;", local_edits)
+        for row in local_edits:
+            await self.bot.writer.put("talking_stats", row)
 
     @commands.command()
     async def activity(self, ctx, target: commands.Member = None):
@@ -63,10 +64,15 @@ class Currency(commands.Cog):
         self.lock = asyncio.Lock()
         self.activity = commands.CooldownMapping.from_cooldown(5, 900, commands.BucketType.member)
         self.activity_loop.start({})
+        bot.pipeline.add("currency", self.on_message, priority=10)
 
     def cog_unload(self):
+        self.bot.pipeline.remove("currency")
         self.activity_loop.cancel()
 
+    async def on_message(self, ctx):
+        self.activity.update_rate_limit(ctx.message)
+
     @tasks.loop(minutes=15)
     async def activity_loop(self, cache: dict):
         edits = []
@@ -91,8 +97,8 @@ class Currency(commands.Cog):
             await self.db.executemany("WITH child AS (SELECT user_token FROM connections WHERE discord_id=$3) UPDATE "
                                   "points_data SET points = points + $1 WHERE parent_token = $2 AND child_token = (select * from child)", edits)
 
-        if local_edits:
-            await self.bot.pg.executemany("INSERT INTO talking_stats VALUES ($1,$2,$3) ON CONFLICT (guild_id, user_id) DO UPDATE SET messages = talking_stats.messages + 1;", local_edits)
+        for row in local_edits:
+            await self.bot.writer.put("talking_stats", row)
 
 
     async def points_for(self, member: commands.Member, conn=None):
@@ -28,6 +28,10 @@ class _CustomCommands(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        bot.pipeline.add("customcommands", self.trigger, priority=110)
+
+    def cog_unload(self):
+        self.bot.pipeline.remove("customcommands")
 
     async def parse(self, ctx, view: StringView, string: str) -> str:
         params = ""
@@ -80,37 +84,25 @@ class _CustomCommands(commands.Cog):
             await ctx.send(f"__Your script has encountered an error:__\n" + discord.utils.escape_markdown(traceback.format_exception(type(e), e, e.__traceback__)))
 
 
-    @commands.Cog.listener("on_message")
-    async def trigger(self, message: discord.Message):
-        if message.author.bot or not self.bot.setup or message.guild is None or not \
-                self.bot.guild_module_states[message.guild.id]['commands']:
+    async def trigger(self, msgctx):
+        if msgctx.prefix is None or msgctx.config is None or not msgctx.config.has_module("commands"):
             return
 
+        message = msgctx.message
         args = StringView(message.content)
-        prefs = await self.bot.get_prefix(message)
-        v = False
-        if isinstance(prefs, list):
-            for prefix in prefs:
-                if message.content.startswith(prefix):
-                    v = True
-                    args.skip_string(prefix)
-                    break
-
-        else:
-            if args.skip_string(prefs):
-                v = True
-
-        if not v:
-            return
+        args.skip_string(msgctx.prefix)
 
         com = args.get_word()
         args.skip_ws()
+        if com in self.bot.all_commands:
+            # the commands stage runs alongside this one, a custom command can't shadow a real one
+            return
 
         data = await self.bot.pg.fetchrow("SELECT content, is_script FROM commands WHERE guild_id=$1 AND name=$2;", message.guild.id, com)
         if not data:
             return
 
-        ctx = await self.bot.get_context(message)
+        ctx = await self.bot.get_context(message, prefix=msgctx.prefix)
         if not data['is_script']:
             v = await self.parse(ctx, args, data['content'])
             await message.channel.send(v)
@@ -1,68 +1,239 @@
 # kudos to lambda for helping me with this
 
 from utils import commands, btime
+from utils.caches import RecentMessage, RecentMessages
 import typing
 import datetime
 import asyncio
-import re
+import time
+import collections
+
+from utils.batching import Batcher
+from utils.matchers import Automaton, scan_window
 
 def setup(bot):
     bot.add_cog(_highlight(bot))
 
+class GuildHighlights:
+    """
+    every highlight word in a guild, in one automaton.
+    each (lowercased) word maps to the set of users that have it, so a message is scanned once no matter how many
+    people have highlights set up. blocks are indexed the other way around, by the channel or user being blocked.
+    adding or removing a user only touches their own words and blocks.
+    """
+    def __init__(self):
+        self.automaton = Automaton(boundary=True)
+        self.users = {} # user id: (set of words, set of (rcid, rc) blocks)
+        self.channel_blocks = {} # channel id: set of user ids that blocked it
+        self.author_blocks = {} # user id: set of user ids that blocked them
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, uid):
+        return uid in self.users
+
+    @staticmethod
+    def _diff(index: dict, uid: int, old, new):
+        for key in old - new:
+            subscribers = index[key]
+            subscribers.discard(uid)
+            if not subscribers:
+                del index[key]
+
+        for key in new - old:
+            subscribers = index.get(key)
+            if subscribers is None:
+                index[key] = {uid}
+            else:
+                subscribers.add(uid)
+
+    def set_user(self, uid: int, words, blocks):
+        words = {word.lower() for word in words}
+        blocks = set(blocks)
+        old_words, old_blocks = self.users.get(uid, (set(), set()))
+
+        for word in old_words - words:
+            subscribers = self.automaton[word]
+            subscribers.discard(uid)
+            if not subscribers:
+                self.automaton.remove(word)
+
+        for word in words - old_words:
+            subscribers = self.automaton.get(word)
+            if subscribers is None:
+                self.automaton.add(word, {uid})
+            else:
+                subscribers.add(uid)
+
+        # rc is 1 for channels, 0 for users
+        self._diff(self.channel_blocks, uid, {i for i, rc in old_blocks if rc == 1}, {i for i, rc in blocks if rc == 1})
+        self._diff(self.author_blocks, uid, {i for i, rc in old_blocks if rc == 0}, {i for i, rc in blocks if rc == 0})
+        self.users[uid] = (words, blocks)
+
+    def remove_user(self, uid: int):
+        if uid in self.users:
+            self.set_user(uid, (), ())
+            del self.users[uid]
+
+    def match(self, content: str, channel_id: int, author_id: int) -> dict:
+        """
+        returns {user id: the first of their words found in the (already lowercased) content},
+        leaving out anyone that blocked the channel or the author
+        """
+        found = {}
+        for _, _, word in self.automaton.iter(content):
+            for uid in self.automaton[word]:
+                if uid not in found:
+                    found[uid] = word
+
+        if found:
+            for uid in self.channel_blocks.get(channel_id, ()):
+                found.pop(uid, None)
+            for uid in self.author_blocks.get(author_id, ()):
+                found.pop(uid, None)
+
+        return found
+
+
 class _highlight(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db = bot.pg
         self.cache = bot.highlight_cache
+        # recent messages of channels in guilds with highlights, so the context doesn't have to be fetched
+        self.recent = RecentMessages(per_channel=50)
+        # trigger message id: task fetching the history around it, shared by everyone highlighted by that message
+        self._history = {}
+        # highlights for the same person within the window get folded into one dm.
+        # the delay doubles as the wait for the conversation after the trigger to happen
+        self.deliveries = Batcher(self.deliver, delay=15, max_items=10, concurrency=5, max_pending=5000, loop=bot.loop)
+        # user id: (when we can try again, how long the last backoff was), for people that don't accept dms
+        self.dm_closed = {}
+        self.stats = collections.Counter()
         self.bot.loop.create_task(self.build_full_cache())
 
+        # sees bot messages too, they're part of the context around a highlight
+        bot.pipeline.add("highlight", self.on_message, priority=40, bots=True)
+
+    def cog_unload(self):
+        self.bot.pipeline.remove("highlight")
+        self.bot.loop.create_task(self.deliveries.close())
+
     def format_message(self, cont: str):
         if len(cont) > 100:
             cont = cont[0:100] + "..."
         return cont
 
+    async def fetch_context(self, trigger_msg: commands.Message) -> list:
+        messages = self.recent.around(trigger_msg, 4, 4)
+        if messages is not None:
+            return messages
+
+        # the buffer is cold, fall back to the api. one request per message, not per highlighted user
+        task = self._history.get(trigger_msg.id)
+        if task is None:
+            task = self.bot.loop.create_task(trigger_msg.channel.history(limit=9, around=trigger_msg, oldest_first=True).flatten())
+            self._history[trigger_msg.id] = task
+            task.add_done_callback(lambda _: self._history.pop(trigger_msg.id, None))
+
+        return [RecentMessage.from_message(m) for m in await asyncio.shield(task)]
+
     async def assemble_messages(self, trigger_msg: commands.Message, target: commands.User)->list:
-        around = trigger_msg.channel.history(limit=9, around=trigger_msg, oldest_first=True)
-        ret = []
-        async for a in around:
-            if a.author == target and (datetime.datetime.utcnow() - a.created_at).total_seconds() <= 60:
+        try:
+            around = await self.fetch_context(trigger_msg)
+        except commands.HTTPException:
+            return None
+
+        now = datetime.datetime.utcnow()
+        for a in (*self.recent.get(trigger_msg.channel.id), *around):
+            if a.author_id == target.id and (now - a.created_at).total_seconds() <= 60:
                 return None
+
+        ret = []
+        for a in around:
             if a.id == trigger_msg.id:
-                ret.append(f"**\[{a.created_at.strftime('%I:%M %p')} UTC - {a.author}\]** : {self.format_message(a.content)}")
+                ret.append(f"**\[{a.created_at.strftime('%I:%M %p')} UTC - {a.author_name}\]** : {self.format_message(a.content)}")
             else:
-                ret.append(f"\[{a.created_at.strftime('%I:%M %p')} UTC - {a.author}\] : {self.format_message(a.content)}")
+                ret.append(f"\[{a.created_at.strftime('%I:%M %p')} UTC - {a.author_name}\] : {self.format_message(a.content)}")
         return ret
 
-    async def do_highlight(self, trigger_msg: commands.Message, user: commands.User, trigger: str):
-        await asyncio.sleep(10)
-        cont = await self.assemble_messages(trigger_msg, user)
-        if cont is None:
+    def queue_highlight(self, trigger_msg: commands.Message, user: commands.Member, trigger: str):
+        closed = self.dm_closed.get(user.id)
+        if closed is not None:
+            if closed[0] > time.monotonic():
+                self.stats['dms closed'] += 1
+                return
+
+        if not self.deliveries.add(user.id, (trigger_msg, user, trigger)):
+            self.stats['queue full'] += 1
+
+    async def deliver(self, uid: int, items: list):
+        entries = []
+        for trigger_msg, user, trigger in items:
+            cont = await self.assemble_messages(trigger_msg, user)
+            if cont is not None:
+                entries.append((trigger_msg, trigger, cont))
+
+        if not entries:
             return
-        assembled = "\n".join(cont)
-        emb = commands.Embed(title=f"**{trigger}**", color=0x36393E, timestamp=datetime.datetime.utcnow())
-        emb.set_footer(text="highlighted at")
-        emb.description = assembled
-        emb.add_field(name="To the message!", value=f"[Message]({trigger_msg.jump_url})")
+
+        user = items[0][1]
+        if len(entries) == 1:
+            trigger_msg, trigger, cont = entries[0]
+            content = f"You've been highlighted in {trigger_msg.channel.mention} with trigger word **{trigger}**"
+            emb = commands.Embed(title=f"**{trigger}**", color=0x36393E, timestamp=datetime.datetime.utcnow())
+            emb.set_footer(text="highlighted at")
+            emb.description = "\n".join(cont)
+            emb.add_field(name="To the message!", value=f"[Message]({trigger_msg.jump_url})")
+
+        else:
+            content = f"You've been highlighted {len(entries)} times in {entries[0][0].guild.name}"
+            emb = commands.Embed(title="Highlights", color=0x36393E, timestamp=datetime.datetime.utcnow())
+            emb.set_footer(text="highlighted at")
+            for trigger_msg, trigger, _ in entries:
+                emb.add_field(name=f"**{trigger}** in #{trigger_msg.channel}",
+                              value=f"{trigger_msg.author}: {self.format_message(trigger_msg.content)}\n[Message]({trigger_msg.jump_url})",
+                              inline=False)
+
         try:
-            await user.send(f"You've been highlighted in {trigger_msg.channel.mention} with trigger word **{trigger}**",embed=emb)
-        except:
-            pass
-
-    def build_re(self, highlights):
-        return re.compile((
-                              r'(?i)'  # case insensitive
-                              r'\b'  # word bound
-                              r'(?:{})'  # non capturing group, to make sure that the word bound occurs before/after all words
-                              r'\b'
-                          ).format('|'.join(map(re.escape, highlights))))
+            await user.send(content, embed=emb)
+        except commands.Forbidden:
+            # dms are closed. back off, doubling each time it happens again, up to a day
+            backoff = min(self.dm_closed.get(uid, (0, 1800))[1] * 2, 86400)
+            self.dm_closed[uid] = time.monotonic() + backoff, backoff
+            self.stats['failed'] += 1
+        except commands.HTTPException:
+            self.stats['failed'] += 1
+        else:
+            self.dm_closed.pop(uid, None)
+            self.stats['delivered'] += len(entries)
 
     async def build_full_cache(self):
         await self.bot.wait_until_ready()
-        conn = await self.db.acquire()
-        for i in self.bot.guilds:
-            self.cache[i.id] = await self.build_guild_cache(i, conn=conn)
-            if not self.cache[i.id]:
-                del self.cache[i.id]
+        async with self.db.acquire() as conn:
+            hl = await conn.fetch("SELECT guild_id, user_id, word FROM highlights")
+            blocks = await conn.fetch("SELECT guild_id, user_id, rcid, rc FROM hl_blocks")
+
+        guilds = {}
+        for rec in hl:
+            guilds.setdefault(rec['guild_id'], ([], []))[0].append(rec)
+
+        for rec in blocks:
+            if rec['guild_id'] in guilds:
+                guilds[rec['guild_id']][1].append(rec)
+
+        for index, (gid, (words, blocked)) in enumerate(guilds.items()):
+            if self.bot.get_guild(gid) is None:
+                continue
+
+            cache = self.assemble_cache(words, blocked)
+            if cache:
+                self.cache[gid] = cache
+
+            if not index % 100:
+                # let the gateway breathe between chunks of guilds
+                await asyncio.sleep(0)
 
     async def build_guild_cache(self, guild: commands.Guild, conn=None):
         if conn is None:
@@ -76,8 +247,10 @@ class _highlight(commands.Cog):
         if conn is None:
             await self.db.release(connection)
 
+        return self.assemble_cache(hl, blocks)
+
+    def assemble_cache(self, hl, blocks) -> GuildHighlights:
         din = {}
-        dout = {}
         for rec in hl:
             uid = rec['user_id']
             word = rec['word']
@@ -88,18 +261,12 @@ class _highlight(commands.Cog):
 
         for rec in blocks:
             uid = rec['user_id']
-            cmid = rec['rcid']
-            mc = rec['rc']
             if uid in din:
-                din[uid]['blocks'].append((cmid, mc))
-            else:
-                din[uid] = {"words": [], "blocks": [(cmid, mc)]}
+                din[uid]['blocks'].append((rec['rcid'], rec['rc']))
 
+        dout = GuildHighlights()
         for uid, v in din.items():
-            if not v['words']:
-                continue
-
-            dout[uid] = (self.build_re(v['words']), v['blocks'])
+            dout.set_user(uid, v['words'], v['blocks'])
 
         return dout
 
@@ -116,49 +283,47 @@ class _highlight(commands.Cog):
         if conn is None:
             await self.db.release(connection)
 
-        b = []
-        for i in blocks:
-            b.append((i['rcid'], i['rc']))
+        b = [(i['rcid'], i['rc']) for i in blocks]
+        h = [i['word'] for i in hl]
 
-        h = []
-        for i in hl:
-            h.append(i['word'])
-
-        if not h:
-            if member.id in self.cache[member.guild.id]:
-                del self.cache[member.guild.id][member.id]
+        if guild.id not in self.cache:
+            if not h:
+                return
 
-        if member.guild.id not in self.cache:
-            self.cache[member.guild.id] = {}
+            self.cache[guild.id] = GuildHighlights()
 
         if not h:
-            if member.id in self.cache[guild.id]:
-                del self.cache[guild.id][member.id]
-
+            self.cache[guild.id].remove_user(member.id)
             return
 
-        self.cache[guild.id][member.id] = (self.build_re(h), b)
+        self.cache[guild.id].set_user(member.id, h, b)
 
-    @commands.Cog.listener()
-    async def on_message(self, msg: commands.Message):
-        if not msg.guild or msg.author.bot or msg.guild.id not in self.cache:
+    async def on_message(self, ctx):
+        msg = ctx.message
+        if msg.guild.id not in self.cache:
             return
 
-        highlighted = []
-        for mid, m in self.cache[msg.guild.id].items():
-            if mid in highlighted:
-                continue
+        self.recent.add(msg)
+        if ctx.is_bot:
+            return
 
-            if msg.channel.id in [x[0] for x in m[1] if x[1] is 1]:
-                continue
+        budget = self.bot.rule_budget
+        start = time.perf_counter()
+        content = scan_window(ctx.lowered, budget.scan_length(msg.guild.id, "highlight"))
+        for mid, word in self.cache[msg.guild.id].match(content, msg.channel.id, msg.author.id).items():
+            member = msg.guild.get_member(mid)
+            if member is not None:
+                self.queue_highlight(msg, member, word)
 
-            if msg.author.id in [x[0] for x in m[1] if x[1] is 0]:
-                continue
+        budget.record(msg.guild.id, "highlight", time.perf_counter() - start)
 
-            v = m[0].search(msg.content)
-            if v:
-                highlighted.append(mid)
-                self.bot.loop.create_task(self.do_highlight(msg, msg.guild.get_member(mid), v.group()))
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: commands.RawMessageDeleteEvent):
+        self.recent.remove(payload.channel_id, (payload.message_id,))
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: commands.RawBulkMessageDeleteEvent):
+        self.recent.remove(payload.channel_id, payload.message_ids)
 
     @commands.group(invoke_without_command=True, aliases=["hl"])
     @commands.guild_only()
@@ -205,8 +370,8 @@ class _highlight(commands.Cog):
             await conn.execute("DELETE FROM highlights WHERE guild_id = $1 AND user_id = $2;", ctx.guild.id, ctx.author.id)
             await conn.execute("DELETE FROM hl_blocks WHERE guild_id = $1 AND user_id $2;", ctx.guild.id, ctx.author.id)
 
-        if ctx.guild.id in self.cache and ctx.author.id in self.cache[ctx.guild.id]:
-            del self.cache[ctx.guild.id][ctx.author.id]
+        if ctx.guild.id in self.cache:
+            self.cache[ctx.guild.id].remove_user(ctx.author.id)
 
         await ctx.send("cleared your highlight triggers and blocks")
 
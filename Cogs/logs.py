@@ -1,9 +1,12 @@
+import collections
 import datetime
 import time
 import typing
 import discord
 
 from utils import btime, commands, objects
+from utils.batching import Batcher
+from utils.caches import AuditLogCache
 
 
 def setup(bot):
@@ -15,19 +18,23 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
         self.bot = bot
         self.bucket = commands.CooldownMapping.from_cooldown(1,0.3,commands.BucketType.guild)
         self.states = bot.logging_states
+        self.audit = AuditLogCache(loop=bot.loop)
+        # log messages are buffered per log channel, and sent up to 10 embeds at a time
+        self.outbox = Batcher(self.deliver, delay=2, max_items=30, concurrency=5, loop=bot.loop)
+        self.delivery = collections.Counter()
+        # channel id: (webhook or None if we can't use one, when we looked it up)
+        self._webhooks = {}
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.outbox.close())
 
     def is_enabled(self, guild):
-        return self.bot.guild_module_states[guild.id]['modlogs'] and guild.id in self.bot.logging_states and self.bot.logging_states[guild.id] is not None
+        config = self.bot.guild_configs.get(guild.id)
+        return config is not None and config.logging is not None and config.has_module("modlogs")
 
     def has_permission(self, guild):
         return guild.me.guild_permissions.view_audit_log
 
-    async def get_audit_logs(self, guild, limit=100, user=None, action=None)->list:
-        try:
-            return await self.bot.get_guild(guild.id).audit_logs(limit=limit, user=user, action=action).flatten()
-        except:
-            return []
-
     def get_embed(self, color=0xFFFF00):
         emb = commands.Embed()
         emb.colour = color
@@ -47,14 +54,100 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
         return self.states[guild.id]
 
     async def send_to_channel(self, state, content=None, embed=None):
-        channel = self.bot.get_channel(state.channel)
+        if not self.outbox.add(state.channel, (content, embed)):
+            self.delivery['dropped'] += 1
+
+    async def find_webhook(self, channel):
+        """
+        the webhook the bot owns in the channel, or None
+        """
+        for hook in await channel.webhooks():
+            if hook.user is not None and hook.user.id == self.bot.user.id:
+                return hook
+
+        return None
+
+    async def get_webhook(self, channel):
+        """
+        the webhook to send logs through. only ever one that already exists, they're created with `logs webhook`
+        """
+        cached = self._webhooks.get(channel.id)
+        if cached is not None and (cached[0] is not None or time.monotonic() - cached[1] < 3600):
+            return cached[0]
+
+        webhook = None
+        if channel.permissions_for(channel.guild.me).manage_webhooks:
+            try:
+                webhook = await self.find_webhook(channel)
+            except commands.HTTPException:
+                webhook = None
+
+        self._webhooks[channel.id] = webhook, time.monotonic()
+        return webhook
+
+    def forget_webhook(self, channel_id: int):
+        self._webhooks.pop(channel_id, None)
+
+    async def deliver(self, channel_id, items):
+        channel = self.bot.get_channel(channel_id)
         if channel is None:
-            return
-
+            self.delivery['dropped'] += len(items)
+            return
+
+        webhook = await self.get_webhook(channel)
+        chunk = []
+        size = 0
+        for content, embed in items:
+            if content is not None or embed is None or webhook is None:
+                # plain text goes out on its own, after everything queued before it
+                webhook = await self.send_chunk(channel, webhook, chunk)
+                chunk, size = [], 0
+                await self.send_single(channel, content, embed)
+                continue
+
+            # a message can hold 10 embeds, with 6000 characters between them
+            if len(chunk) == 10 or size + len(embed) > 6000:
+                webhook = await self.send_chunk(channel, webhook, chunk)
+                chunk, size = [], 0
+
+            chunk.append(embed)
+            size += len(embed)
+
+        await self.send_chunk(channel, webhook, chunk)
+
+    async def send_chunk(self, channel, webhook, embeds: list):
+        """
+        sends the embeds through the webhook. returns the webhook to keep using (None if it stopped working)
+        """
+        if not embeds:
+            return webhook
+
+        if webhook is not None:
+            try:
+                await webhook.send(embeds=embeds, username=self.bot.user.name, avatar_url=str(self.bot.user.avatar_url))
+            except commands.NotFound:
+                # someone deleted it. fall back to the channel for now, and look it up again next time
+                self._webhooks.pop(channel.id, None)
+                webhook = None
+            except commands.HTTPException:
+                self.delivery['failed'] += len(embeds)
+                return webhook
+            else:
+                self.delivery['sent'] += len(embeds)
+                return webhook
+
+        for embed in embeds:
+            await self.send_single(channel, None, embed)
+
+        return webhook
+
+    async def send_single(self, channel, content, embed):
         try:
             await channel.send(content, embed=embed)
         except commands.HTTPException:
-            pass
+            self.delivery['failed'] += 1
+        else:
+            self.delivery['sent'] += 1
 
     @commands.Cog.listener()
     async def on_member_join(self, member, silence=False):
@@ -92,21 +185,19 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
             await self.send_to_channel(state, embed=embed)
             return
 
-        klogs = await self.get_audit_logs(member.guild, limit=1, action=discord.AuditLogAction.kick)
+        log = await self.audit.find(member.guild, (discord.AuditLogAction.kick, discord.AuditLogAction.ban), member.id)
 
-        if klogs and (datetime.datetime.utcnow() - klogs[0].created_at).total_seconds() < 2:
+        if log is not None and log.action is discord.AuditLogAction.kick:
             if not state.member_kick:
                 return
 
-            embed.add_field(name="Moderator", value=klogs[0].user.mention + f" - name: {klogs[0].user} (id: {klogs[0].user.id})")
+            embed.add_field(name="Moderator", value=log.user.mention + f" - name: {log.user} (id: {log.user.id})")
             embed.title = "User Kicked"
             await self.send_to_channel(state, embed=embed)
             return
 
-        blogs = await self.get_audit_logs(member.guild, limit=1, action=discord.AuditLogAction.ban)
-
-        if blogs and (datetime.datetime.utcnow() - blogs[0].created_at).total_seconds() < 2:
-            return
+        if log is not None:
+            return # banned, on_member_ban logs that
 
         # determined its a leave
         await self.send_to_channel(state, embed=embed)
@@ -137,15 +228,21 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
         if state is None or not state.message_delete:
             return
 
+        # messages live in memory first, and only end up in the database once they've fallen out of the cache
+        entry = self.bot.message_cache.pop(payload.message_id)
+
         if payload.message_id in self.bot.logging_ignore:
             self.bot.logging_ignore.remove(payload.message_id)
-            await self.bot.pg.execute("DELETE FROM modlog_messages WHERE message_id = $1;", payload.message_id)
+            if entry is None:
+                await self.bot.pg.execute("DELETE FROM modlog_messages WHERE message_id = $1;", payload.message_id)
             return
 
-
-        msg = await self.bot.pg.fetchrow("SELECT content, user_id FROM modlog_messages WHERE message_id = $1", payload.message_id)
-        if not msg:
-            return
+        if entry is not None:
+            msg = {"content": entry.content, "user_id": entry.user_id}
+        else:
+            msg = await self.bot.pg.fetchrow("SELECT content, user_id FROM modlog_messages WHERE message_id = $1", payload.message_id)
+            if not msg:
+                return
 
         embed = self.get_embed(commands.Color.red())
         embed.title = "Message Deleted"
@@ -158,12 +255,14 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
             await self.send_to_channel(state, embed=embed)
             return
 
-        log = await self.get_audit_logs(guild, limit=1, action=commands.AuditLogAction.message_delete)
-        if log and (datetime.datetime.utcnow() - log[0].created_at).total_seconds() < 2:
-            embed.add_field(name="Deleted by", value=f"{log[0].user.mention} - {log[0].user} (id: {log[0].user.id})")
+        log = await self.audit.find(guild, (commands.AuditLogAction.message_delete,), msg['user_id'],
+                                    check=lambda e: getattr(e.extra.channel, "id", None) == payload.channel_id)
+        if log is not None:
+            embed.add_field(name="Deleted by", value=f"{log.user.mention} - {log.user} (id: {log.user.id})")
 
         await self.send_to_channel(state, embed=embed)
-        await self.bot.pg.execute("DELETE FROM modlog_messages WHERE message_id = $1;", payload.message_id)
+        if entry is None:
+            await self.bot.pg.execute("DELETE FROM modlog_messages WHERE message_id = $1;", payload.message_id)
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload: commands.RawBulkMessageDeleteEvent):
@@ -182,40 +281,55 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
         embed.description = f"<:messagedelete:684549889182531604>\n {amount} messages deleted"
         
         await self.send_to_channel(state, embed=embed)
-        await self.bot.pg.executemany("DELETE FROM modlog_messages WHERE message_id = $1;", list(payload.message_ids))
+        spilled = [(x,) for x in payload.message_ids if self.bot.message_cache.pop(x) is None]
+        if spilled:
+            await self.bot.pg.executemany("DELETE FROM modlog_messages WHERE message_id = $1;", spilled)
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: commands.RawMessageUpdateEvent):
-        msg = await self.bot.pg.fetchrow("SELECT * FROM modlog_messages WHERE message_id = $1", payload.message_id)
-        if msg is None:
-            return
+        # everything before the cache lookup is in memory, so most edits (embeds unfurling, pins) stop here for free
+        data = payload.data
+        content = data.get("content")
+        if content is None or "guild_id" not in data:
+            return # not a content edit
 
-        guild = self.bot.get_guild(msg['guild_id'])
-        author = self.bot.get_user(msg['user_id'])
-        if author.bot:
+        state = self.get_state(self.bot.get_guild(int(data['guild_id'])))
+        if state is None or not state.message_edit:
             return
 
-        state = self.get_state(guild)
-        if state is None or not state.message_edit:
+        author = data.get("author") or {}
+        if author.get("bot"):
             return
 
-        try:
-            message = await self.bot.get_channel(msg['channel_id']).fetch_message(msg['message_id']) #type: commands.Message
-        except commands.HTTPException:
-            return # doesnt exist?
+        entry = self.bot.message_cache.get(payload.message_id)
+        if entry is not None:
+            before, user_id = entry.content, entry.user_id
+        elif payload.cached_message is not None:
+            before, user_id = payload.cached_message.content, payload.cached_message.author.id
+        else:
+            msg = await self.bot.pg.fetchrow("SELECT content, user_id FROM modlog_messages WHERE message_id = $1", payload.message_id)
+            if msg is None:
+                return
 
-        if message.content == msg['content']:
+            before, user_id = msg['content'], msg['user_id']
+
+        if content == before:
             return
 
-        await self.bot.pg.execute("UPDATE modlog_messages SET content=$1 WHERE message_id = $2", message.content,
-                                  message.id)
+        if entry is not None:
+            self.bot.message_cache.update(payload.message_id, content)
+        else:
+            # it might have been spilled to the database already
+            await self.bot.pg.execute("UPDATE modlog_messages SET content=$1 WHERE message_id = $2", content,
+                                      payload.message_id)
 
+        name = f"{author['username']}#{author['discriminator']}" if "username" in author else str(self.bot.get_user(user_id))
         embed = self.get_embed()
         embed.title = "Message Edited"
-        embed.description = f"<:messageupdate:684549899039408179> {message.author.mention} - {message.author}"
-        embed.add_field(name="Before", value=msg['content'])
-        embed.add_field(name="After", value=message.content)
-        embed.set_footer(text=f"id: {message.author.id}")
+        embed.description = f"<:messageupdate:684549899039408179> <@{user_id}> - {name}"
+        embed.add_field(name="Before", value=before)
+        embed.add_field(name="After", value=content)
+        embed.set_footer(text=f"id: {user_id}")
 
         await self.send_to_channel(state, embed=embed)
 
@@ -245,9 +359,9 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
         embed.set_footer(text=f"channel id: {channel.id}")
 
         if self.has_permission(channel.guild):
-            log = await self.get_audit_logs(channel.guild, limit=1, action=commands.AuditLogAction.channel_delete)
-            log = log[0]
-            embed.description += f"\ndeleted by: {log.user}"
+            log = await self.audit.find(channel.guild, (commands.AuditLogAction.channel_delete,), channel.id)
+            if log is not None:
+                embed.description += f"\ndeleted by: {log.user}"
 
         await self.send_to_channel(state, embed=embed)
 
@@ -340,9 +454,9 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
             await self.send_to_channel(state, embed=embed)
             return
 
-        log = await self.get_audit_logs(guild, limit=1, action=discord.AuditLogAction.ban)
-        log = log[0]
-        embed.add_field(name="Moderator", value=f"{log.user.mention} - {log.user} (id: {log.user.id})")
+        log = await self.audit.find(guild, (discord.AuditLogAction.ban,), user.id)
+        if log is not None:
+            embed.add_field(name="Moderator", value=f"{log.user.mention} - {log.user} (id: {log.user.id})")
         await self.send_to_channel(state, embed=embed)
 
 
@@ -362,9 +476,11 @@ class logging(commands.Cog, command_attrs=dict(hidden=True)):
             await self.send_to_channel(state, embed=embed)
             return
 
-        logs = (await self.get_audit_logs(guild, limit=1, action=discord.AuditLogAction.unban))[0]
+        log = await self.audit.find(guild, (discord.AuditLogAction.unban,), user.id)
+        if log is not None:
+            embed.add_field(name="Moderator", value=str(log.user))
 
-        embed.add_field(name="Moderator", value=str(logs.user))
+        await self.send_to_channel(state, embed=embed)
 
     async def on_member_mute(self, guild, user, length, mod="Unknown Moderator", reason="Unknown Reason"):
         state = self.get_state(guild)
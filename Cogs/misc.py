@@ -175,7 +175,7 @@ class misc(commands.Cog):
         m = await ctx.send("that's it for setup! saving your data now...")
         await self.bot.db.execute("INSERT INTO roles VALUES ($5,$1,$2,$3,$4) ON CONFLICT (guild_id) DO UPDATE SET editor=$1, muted=$2, moderator=$3, manager=$4 WHERE guild_id = $5",
                                   roles['Bot Editor'], roles['Muted'], roles['Moderator'], roles['Community Manager'], ctx.guild.id)
-        self.bot.guild_role_states[ctx.guild.id] = {"moderator": roles['Moderator'], "editor": roles['Bot Editor'], "muted": roles['Muted'], "manager": roles['Community Manager']}
+        self.bot.update_config(ctx.guild.id, moderator=roles['Moderator'], editor=roles['Bot Editor'], muted=roles['Muted'], manager=roles['Community Manager'])
         await self.bot.get_cog("_modlogs").db.execute("UPDATE modlogs SET channel=? WHERE guild_id IS ?", msc_cfg['mod_logs_channel'], ctx.guild.id)
         await self.bot.get_cog("automodCog").db.execute("UPDATE automod_config SET enabled=? WHERE guild_id IS ?", msc_cfg['automod_channel'], ctx.guild.id)
         self.bot.automod_states[ctx.guild.id]['channel'] = msc_cfg['automod_channel']
@@ -273,6 +273,10 @@ class misc(commands.Cog):
         await self.bot.pg.execute("INSERT INTO reminders"
                                   " VALUES ($1,$2,$3,$4,$5,$6)", ctx.guild.id, ctx.channel.id,
                                         when.arg, when.dt, ctx.message.jump_url, ctx.author.id)
+        system = self.bot.get_cog("SystemCog")
+        if system is not None:
+            system.queue_reminder(when.dt)
+
         await ctx.send(f"{ctx.author.mention} reminding you in {delta}: {when.arg}")
 
     async def pred(ctx):
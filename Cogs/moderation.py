@@ -3,7 +3,7 @@ import typing
 import json
 import discord
 
-from utils import btime, db, commands
+from utils import btime, caches, db, commands
 from utils.checks import *
 from utils.objects import HOIST_CHARACTERS
 
@@ -121,7 +121,7 @@ class moderation(commands.Cog):
         allows a user to talk again in the server.
         you must have the `moderator` role to use this command
         """
-        role = ctx.guild.get_role(self.bot.guild_role_states[ctx.guild.id]['muted'])
+        role = ctx.guild.get_role(self.bot.guild_configs[ctx.guild.id].muted)
         if not role:
             return await ctx.send("No mute role set up!")
 
@@ -147,7 +147,7 @@ class moderation(commands.Cog):
         if reason is None:
             reason = f'Action done by {mod} (ID: {mod.id})'
 
-        role = ctx.guild.get_role(self.bot.guild_role_states[ctx.guild.id]['muted'])
+        role = ctx.guild.get_role(self.bot.guild_configs[ctx.guild.id].muted)
         if not role:
             return await ctx.send("No Muted role set for your server! contact a Bot Editor to set one up!")
 
@@ -172,7 +172,7 @@ class moderation(commands.Cog):
         if reason is None:
             reason = f'Action done by {ctx.author} (ID: {ctx.author.id})'
 
-        role = ctx.guild.get_role(self.bot.guild_role_states[ctx.guild.id]['muted'])
+        role = ctx.guild.get_role(self.bot.guild_configs[ctx.guild.id].muted)
         if not role:
             return await ctx.send("No mute role set")
 
@@ -214,9 +214,10 @@ class moderation(commands.Cog):
 
         await ctx.paginate(hoisters, title="Removed the following hoisters")
 
-    async def do_removal(self, ctx, limit, predicate, *, before=None, after=None):
+    async def do_removal(self, ctx, limit, predicate, *, before=None, after=None, author=None):
         """
-        this function was borrowed from Danny's RoboDanny
+        this function was borrowed from Danny's RoboDanny.
+        when removing a single `author`'s messages, the bot's message index is used instead of scanning history, if it can
         """
         if limit > 2000:
             await ctx.send(f'Too many messages to search given ({limit}/2000)')
@@ -228,8 +229,21 @@ class moderation(commands.Cog):
 
         if after is not None:
             after = discord.Object(id=after)
+
+        ids = None
+        if author is not None and after is None:
+            ids = ctx.bot.message_index.search(ctx.channel.id, limit, author_id=author.id, before=before.id)
+
         try:
-            deleted = await ctx.channel.purge(limit=limit, before=before, after=after, check=predicate)
+            if ids is not None:
+                recent, old = caches.split_by_age(ids)
+                for i in range(0, len(recent), 100):
+                    await ctx.channel.delete_messages([discord.Object(id=x) for x in recent[i:i+100]])
+                for message_id in old:
+                    await ctx.channel.get_partial_message(message_id).delete()
+                deleted = ids
+            else:
+                deleted = await ctx.channel.purge(limit=limit, before=before, after=after, check=predicate)
         except discord.Forbidden:
             await ctx.send('I need the Manage Messages permission!')
             return False
@@ -261,7 +275,7 @@ class moderation(commands.Cog):
         """
         removes messages from a certain user
         """
-        if await self.do_removal(ctx, amount, lambda m: m.author.id == user.id):
+        if await self.do_removal(ctx, amount, lambda m: m.author.id == user.id, author=user):
             await ctx.message.add_reaction("\N{THUMBS UP SIGN}")
 
     @remove.command()
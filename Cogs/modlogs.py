@@ -1,5 +1,3 @@
-import asyncio
-
 import discord
 from discord import utils
 
@@ -38,34 +36,48 @@ class _modlogs(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.cache = bot.logging_states
+        # messages only hit the database once they fall out of the in-memory cache
+        bot.message_cache.on_evict = self.spill_message
+        bot.pipeline.add("modlogs", self.on_message, priority=20)
 
-    async def cog_check(self, ctx):
-        if not self.bot.guild_module_states[ctx.guild.id]['modlogs']:
-            raise errors.ModuleDisabled("modlogs")
+    def cog_unload(self):
+        self.bot.pipeline.remove("modlogs")
+        self.bot.message_cache.on_evict = None
+        # nothing spills the cache while the cog is unloaded, so what's in it goes to the database now
+        self.bot.loop.create_task(self.spill_messages(self.bot.message_cache.drain()))
 
-        return True
+    def logs_messages(self, guild_id):
+        state = self.cache.get(guild_id)
+        return state is not None and (state.message_delete or state.message_edit)
 
-    @commands.Cog.listener()
-    async def on_message(self, message: commands.Message):
-        if message.author.bot or not message.content or not message.guild:
-            return
+    def spill_message(self, entry):
+        if self.logs_messages(entry.guild_id):
+            self.bot.writer.put_nowait("modlog_messages", entry.record())
 
-        if message.guild.id not in self.cache:
-            await asyncio.sleep(5) # the on_message event is being called after this one. wait for it to complete (which hopefully wont take more than 5 seconds)
+    async def spill_messages(self, entries):
+        """
+        writes out a batch of cached messages, ex. on shutdown.
+        waits for the writer to catch up instead of dropping rows, there can be far more of these than it buffers
+        """
+        for entry in entries:
+            if self.logs_messages(entry.guild_id):
+                await self.bot.writer.put("modlog_messages", entry.record())
 
-        if message.guild.id not in self.cache:
-            return # forget it
+    async def cog_check(self, ctx):
+        if not self.bot.guild_configs[ctx.guild.id].has_module("modlogs"):
+            raise errors.ModuleDisabled("modlogs")
 
-        state = self.cache[message.guild.id] #type: objects.LoggingFlags
+        return True
 
-        if state is None:
+    async def on_message(self, ctx):
+        state = ctx.logging_state #type: objects.LoggingFlags
+        if state is None or not ctx.content:
             return
 
         if not state.message_delete and not state.message_edit:
             return
 
-        await self.bot.pg.execute("INSERT INTO modlog_messages VALUES ($1,$2,$3,$4,$5,$6)", message.guild.id,
-                                  message.channel.id, message.id, message.author.id, message.created_at, message.content)
+        self.bot.message_cache.add(ctx.message)
 
     @commands.group(invoke_without_command=True, aliases=['logs', 'logger'], walk_help=False)
     @ensure_logging()
@@ -150,6 +162,29 @@ class _modlogs(commands.Cog):
         await state.save()
         await ctx.send(f"set all logs to {'on' if on else 'off'}")
 
+    @modlogs.command("webhook")
+    @ensure_logging()
+    @check_editor()
+    async def ms_webhook(self, ctx):
+        """
+        creates a webhook in the logs channel, so logs can be sent several at a time instead of one message each.
+        requires the bot to have the `Manage Webhooks` permission in that channel
+        """
+        logs = self.bot.get_cog("logging")
+        channel = ctx.guild.get_channel(self.cache[ctx.guild.id].channel)
+        if logs is None or channel is None:
+            return await ctx.send("Invalid or no logs channel!")
+
+        if not channel.permissions_for(ctx.guild.me).manage_webhooks:
+            return await ctx.send(f"I need the `Manage Webhooks` permission in {channel.mention}")
+
+        if await logs.find_webhook(channel) is not None:
+            return await ctx.send(f"Logs in {channel.mention} already go through a webhook")
+
+        await channel.create_webhook(name=f"{self.bot.user.name} logs", reason=f"logs webhook requested by {ctx.author}")
+        logs.forget_webhook(channel.id)
+        await ctx.send(f"Logs in {channel.mention} will now be sent through a webhook")
+
     @ms_chan.command(aliases=['clear'])
     @ensure_logging()
     @check_editor()
@@ -46,8 +46,10 @@ class Prometheus(commands.Cog):
 
         self.stats_five_minutes.start()
         self.stats_thirty_seconds.start()
+        bot.pipeline.add("prometheus", self.on_message, priority=0, bots=True, dms=True)
 
     def cog_unload(self):
+        self.bot.pipeline.remove("prometheus")
         self.task.cancel()
 
     async def metrics_handle(self, _): # noqa
@@ -121,8 +123,7 @@ class Prometheus(commands.Cog):
         self.gauges.labels(count='users').set(len(self.bot.users))
         self.gauges.labels(count='guilds').dec()
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message) -> None:
+    async def on_message(self, ctx) -> None:
         self.counters.labels(stat='messages').inc()
 
     @commands.Cog.listener()
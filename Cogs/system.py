@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 import sys
@@ -15,7 +16,7 @@ import tabulate
 import aiohttp
 from discord.ext import tasks
 
-from utils import checks, errors, commands, paginator, objects, btime as timeutil
+from utils import checks, errors, commands, paginator, objects, scheduler, btime as timeutil
 from utils.objects import HOIST_CHARACTERS
 import inspect
 # run these now, because the first calls made to these return nothing useful.
@@ -54,10 +55,15 @@ def setup(bot):
 class SystemCog(commands.Cog, command_attrs=dict(hidden=True)):
     def __init__(self, bot):
         self.bot = bot
-        self.loop_reminders.start()
+        # only knows when reminders are due. the rows themselves are claimed from the database when they fire
+        self.reminders = scheduler.DueQueue(self.fire_reminders, loop=bot.loop)
+        self.load_reminders_task = bot.loop.create_task(self.load_reminders())
+        bot.pipeline.add("afk", self.afk_runner, priority=50)
 
     def cog_unload(self):
-        self.loop_reminders.cancel()
+        self.bot.pipeline.remove("afk")
+        self.load_reminders_task.cancel()
+        self.bot.loop.create_task(self.reminders.close())
 
     def cog_check(self, ctx):
         return ctx.bot.is_owner(ctx.author)
@@ -66,11 +72,8 @@ class SystemCog(commands.Cog, command_attrs=dict(hidden=True)):
     async def on_guild_join(self, guild: discord.Guild, *args):
         await self.bot.pg.execute("INSERT INTO roles VALUES ($1,0,0,0,0,0)", guild.id)
 
-    @commands.Cog.listener("on_message")
-    async def afk_runner(self, message):
-        if message.author.bot or message.guild is None:
-            return
-
+    async def afk_runner(self, ctx):
+        message = ctx.message
         if not message.mentions:
             return
 
@@ -84,7 +87,8 @@ class SystemCog(commands.Cog, command_attrs=dict(hidden=True)):
                 except:
                     pass
 
-                return await self.bot.pg.execute("DELETE FROM afks WHERE user_id = $1 AND guild_id = $2", (message.author.id, message.guild.id))
+                await self.bot.pg.execute("DELETE FROM afks WHERE user_id = $1 AND guild_id = $2", message.author.id, message.guild.id)
+                return
 
             for i in message.mentions:
                 if i.id == uid:
@@ -98,22 +102,57 @@ class SystemCog(commands.Cog, command_attrs=dict(hidden=True)):
 
             await message.channel.send(f"hey {message.author.mention}! {msg}")
 
-    @tasks.loop(seconds=5)
-    async def loop_reminders(self):
-        if not self.bot.is_ready():
-            return
+    def queue_reminder(self, when: datetime.datetime):
+        """
+        makes sure the queue wakes up by `when`. the reminder itself should already be in the reminders table
+        """
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=datetime.timezone.utc)
+
+        due = when.timestamp()
+        # keyed by due time: reminders due at the same moment share one wake up, which claims all of them
+        if due not in self.reminders:
+            self.reminders.schedule(due, due)
+
+    async def load_reminders(self):
+        await self.bot.wait_until_ready()
+        for record in await self.bot.pg.fetch("SELECT DISTINCT remind_time FROM reminders"):
+            self.queue_reminder(record['remind_time'])
+
+        self.reminders.start()
+
+    async def fire_reminders(self, due):
+        # deleting the rows claims them, so a reminder is never sent twice,
+        # not by another process, and not after a restart
+        rems = await self.bot.pg.fetch("DELETE FROM reminders WHERE remind_time <= $1 RETURNING *", datetime.datetime.utcnow())
+        channels = collections.defaultdict(list)
+        for gid, cid, msg, remindtime, link, uid in rems:
+            channels[cid].append(f"Hey <@{uid}>! Here's a reminder: {msg}\n\noriginal message: {link}")
 
-        rems = await self.bot.pg.fetch("SELECT * FROM reminders WHERE remind_time <= $1", datetime.datetime.utcnow())
-        if not rems:
+        await asyncio.gather(*(self.send_reminders(cid, lines) for cid, lines in channels.items()))
+
+    async def send_reminders(self, channel_id: int, lines: list):
+        chan = self.bot.get_channel(channel_id)
+        if chan is None:
             return
 
-        for gid, cid, msg, remindtime, link, uid in rems:
-            if remindtime <= datetime.datetime.utcnow():
-                chan = self.bot.get_channel(cid)
-                if chan:
-                    await chan.send(f"Hey <@{uid}>! Here's a reminder: {msg}\n\noriginal message: {link}")
+        # one message per channel, as long as they fit
+        chunk = ""
+        for line in lines:
+            if chunk and len(chunk) + len(line) + 2 > 2000:
+                await self._send_reminder(chan, chunk)
+                chunk = ""
+
+            chunk = f"{chunk}\n\n{line}" if chunk else line[:2000]
 
-        await self.bot.pg.execute("DELETE FROM reminders WHERE remind_time <= $1", datetime.datetime.utcnow())
+        if chunk:
+            await self._send_reminder(chan, chunk)
+
+    async def _send_reminder(self, chan, content: str):
+        try:
+            await chan.send(content)
+        except discord.HTTPException:
+            pass
 
     @commands.Cog.listener()
     async def on_unmute(self, data: dict):
@@ -192,6 +231,26 @@ class SystemCog(commands.Cog, command_attrs=dict(hidden=True)):
             thread_count = proc.num_threads()
             e.add_field(name="PID", value=str(pid))
             e.add_field(name="Thread Count", value=str(thread_count))
+        budget = self.bot.rule_budget
+        if budget.overruns:
+            v = "\n".join(f"{rule}: {count} overruns, {budget.degraded_runs[rule]} degraded runs" for rule, count in budget.overruns.most_common(10))
+            e.add_field(name="Slow Rules", value=v, inline=False)
+        hl = self.bot.get_cog("_highlight")
+        if hl is not None:
+            v = f"queued: {hl.deliveries.pending}, sending: {hl.deliveries.in_flight}\n" \
+                f"delivered: {hl.stats['delivered']}, failed: {hl.stats['failed']}\n" \
+                f"dropped: {hl.stats['dms closed']} (dms closed), {hl.stats['queue full']} (queue full)"
+            e.add_field(name="Highlight Deliveries", value=v, inline=False)
+        logs = self.bot.get_cog("logging")
+        if logs is not None:
+            v = f"queued: {logs.outbox.pending}, sending: {logs.outbox.in_flight}\n" \
+                f"sent: {logs.delivery['sent']}, failed: {logs.delivery['failed']}, " \
+                f"dropped: {logs.delivery['dropped']}"
+            e.add_field(name="Log Deliveries", value=v, inline=False)
+        stages = [s for s in self.bot.pipeline.stages if s.calls]
+        if stages:
+            v = "\n".join(f"{s.name}: {s.total / s.calls * 1000:.2f}ms avg, {s.slowest * 1000:.1f}ms max" for s in stages)
+            e.add_field(name="Message Pipeline", value=v, inline=False)
         e.add_field(name="Python Version", value=str(sys.version))
         e.add_field(name="Platform", value=sys.platform)
         await ctx.send(embed=e)
@@ -391,38 +450,21 @@ class MyCog(commands.Cog):
         if self.bot.setup:
             return
 
-        prefixes = await self.bot.pg.fetch("SELECT guild_id, prefix FROM prefixes;")
-
-        for gid, pref in prefixes:
-            if gid in self.bot.guild_prefixes:
-                self.bot.guild_prefixes[gid].append(pref)
-
-            else:
-                self.bot.guild_prefixes[gid] = [pref]
-
-        del prefixes
-
         bans = await self.bot.pg.fetch("SELECT user_id, reason FROM bans;")
         for i in bans:
             self.bot.bans[i['user_id']] = i['reason']
 
         del bans
-        # first, cache the role states.
-        states = await self.bot.pg.fetch("SELECT * FROM roles")
-
-        for record in states:
-            self.bot.guild_role_states[record['guild_id']] = {
-                                                "editor": record['editor'],
-                                                "muted": record['muted'],
-                                                "moderator": record['moderator'],
-                                                "manager": record['manager'],
-                                              }
-
-        # next, cache the module states from existing data.
-        states = await self.bot.pg.fetch("SELECT guild_id, flags FROM modules")
-
-        for record in states:
-            self.bot.guild_module_states[record['guild_id']] = objects.load_modules(record)
+        # first, cache the guild configs (modules, roles, prefixes and logging), all in one go.
+        configs = {}
+        missing_modules, missing_roles = set(), set()
+        for record in await self.bot.pg.fetch(objects.GuildConfig.QUERY):
+            gid = record['guild_id']
+            configs[gid] = objects.GuildConfig.from_record(self.bot.pg, record)
+            if record['flags'] is None:
+                missing_modules.add(gid)
+            if record['roles_guild'] is None:
+                missing_roles.add(gid)
 
         vals = await self.bot.pg.fetch("SELECT * FROM stream_announcer")
         for record in vals:
@@ -432,18 +474,28 @@ class MyCog(commands.Cog):
 
         # next, build the tables for the guilds joined during downtime (if any).
         for guild in self.bot.guilds:
-            if guild.id not in self.bot.guild_prefixes:
-                self.bot.guild_prefixes[guild.id] = []
+            if guild.id not in configs:
+                configs[guild.id] = objects.GuildConfig(guild.id)
+                missing_modules.add(guild.id)
+                missing_roles.add(guild.id)
 
-            if guild.id not in self.bot.guild_module_states:
-                mods = await self.bot.pg.fetchrow("INSERT INTO modules VALUES ($1, $2) RETURNING *", guild.id,
-                                                 objects.save_modules({}))
-                self.bot.guild_module_states[guild.id] = objects.load_modules(mods)
+            if guild.id in missing_modules:
+                await self.bot.pg.execute("INSERT INTO modules VALUES ($1, $2)", guild.id,
+                                          objects.flags_from_modules(objects.ALL_MODULES))
 
-            if guild.id not in self.bot.guild_role_states:
-                self.bot.guild_role_states[guild.id] = {"editor": 0, "muted": 0, "manager": 0, "moderator": 0}
+            if guild.id in missing_roles:
                 await self.bot.pg.execute("INSERT INTO roles VALUES ($1, null, null, null, null)", guild.id)
 
+        for gid, config in configs.items():
+            old = self.bot.guild_configs.get(gid)
+            if old is not None:
+                # automod loads its own state, and might have gotten here first
+                config = config.replace(automod=old.automod)
+
+            self.bot.guild_configs[gid] = config
+
+        self.bot.prefix_matchers.clear()
+
         self.bot.setup = True
         print(f"{':'.join(time.strftime('%H %M %S').split())} cache built.")
         e = discord.Embed(title="Connected", color=discord.Color.green())
@@ -493,7 +545,7 @@ class MyCog(commands.Cog):
 
         muted = await self.bot.pg.fetch("SELECT user_id FROM mutes WHERE guild_id = $1 AND user_id = $2", member.guild.id, member.id)
         if muted:
-            m = member.guild.get_role(self.bot.guild_role_states[member.guild.id]['muted'])
+            m = member.guild.get_role(self.bot.guild_configs[member.guild.id].muted)
             if m:
                 await member.add_roles(m)
 
@@ -511,24 +563,22 @@ class MyCog(commands.Cog):
 
             await guild.leave()
 
-        self.bot.guild_prefixes[guild.id] = ["!"] if self.bot.run_bot != "BOB_ALPHA" else ["]"]
-        self.bot.guild_role_states[guild.id] = {"editor": None, "muted": None, "moderator": None, "manager": None,
-                                            "streamer": None}
+        self.bot.guild_configs[guild.id] = objects.GuildConfig(guild.id, prefixes=["!"] if self.bot.run_bot != "BOB_ALPHA" else ["]"])
+        self.bot.rebuild_prefixes(guild.id)
         async with self.bot.pg.acquire() as conn:
-            mods = await conn.fetchrow("INSERT INTO modules VALUES ($1, $2) RETURNING *", guild.id, objects.save_modules({}))
-            self.bot.guild_module_states[guild.id] = objects.load_modules(mods)
+            await conn.execute("INSERT INTO modules VALUES ($1, $2)", guild.id, objects.flags_from_modules(objects.ALL_MODULES))
             await conn.execute("INSERT INTO roles VALUES ($1, null, null, null, null)", guild.id)
             await conn.execute("INSERT INTO prefixes VALUES ($1,$2)", guild.id, "!")
 
-        self.bot.guild_role_states[guild.id] = {"editor": 0, "muted": 0, "manager": 0, "moderator": 0}
         fmt = f"**__Guild Joined__**\nname: {guild.name}\nid: {guild.id}\nowner: {guild.owner}\n\nMembers: {len(guild.members)}"
         e = commands.Embed(description=fmt, color=discord.Color.teal())
         await self.bot.get_channel(662176688150675476).send(embed=e)
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
-        del self.bot.guild_prefixes[guild.id]
-        del self.bot.guild_module_states[guild.id]
+        self.bot.guild_configs.pop(guild.id, None)
+        self.bot.prefix_matchers.pop(guild.id, None)
+        self.bot.rule_budget.drop(guild.id)
         async with self.bot.pg.acquire() as conn:
             await conn.execute("DELETE FROM roles WHERE guild_id = $1", guild.id)
             await conn.execute("DELETE FROM modules WHERE guild_id = $1", guild.id)
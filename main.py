@@ -21,6 +21,7 @@ import collections
 import datetime
 import json
 import sys
+import time
 
 import traceback
 import logging
@@ -31,10 +32,10 @@ import os
 import aiohttp
 import colorama
 import discord
-from discord.ext import tasks
 import asyncpg
+from discord.ext.commands.view import StringView
 
-from utils import commands, errors, objects
+from utils import batching, caches, commands, errors, matchers, objects, scheduler, trackers
 from utils.context import Contexter
 
 colorama.init(autoreset=True)
@@ -89,15 +90,111 @@ def parse_time(ps, return_times_instead=False):
 async def get_pre(bot, message):
     if not bot.setup:
         return bot.user.mention
-    if message.guild is None:
-        return ["!", "?", ""]
-    try:
-        l = [*bot.guild_prefixes[message.guild.id]]
-    except:
-        l = []
-    if await bot.is_owner(message.author):
-        l.append("$")
-    return commands.when_mentioned_or(*l)(bot, message)
+    return list(bot.prefix_matcher(message.guild).get(message.author.id in bot.owner_ids))
+
+
+# tells get_context that the prefix hasn't been matched yet
+_unmatched = object()
+
+
+class MessageContext:
+    """
+    what the message pipeline works out about a message once, for all of its stages to share
+    """
+    __slots__ = ("message", "guild", "author", "is_bot", "is_dm", "content", "lowered", "prefix",
+                 "config", "logging_state", "automod_state")
+
+    def __init__(self, message):
+        self.message = message
+        self.guild = message.guild
+        self.author = message.author
+        self.is_bot = message.author.bot
+        self.is_dm = message.guild is None
+        self.content = message.content
+        self.lowered = message.content.lower()
+        self.prefix = None # the prefix the message starts with, if any
+        self.config = None # type: objects.GuildConfig
+        self.logging_state = None
+        self.automod_state = None
+
+
+class PipelineStage:
+    __slots__ = ("name", "callback", "priority", "bots", "dms", "ordered", "calls", "total", "slowest")
+
+    def __init__(self, name, callback, priority, bots, dms, ordered):
+        self.name = name
+        self.callback = callback
+        self.priority = priority
+        self.bots = bots
+        self.dms = dms
+        self.ordered = ordered
+        self.calls = 0
+        self.total = 0.0
+        self.slowest = 0.0
+
+
+class MessagePipeline:
+    """
+    the one place messages get handled. cogs register stages (`async def stage(ctx: MessageContext)`).
+    stages added with ordered=True (moderation) run first, one after another in priority order, lowest first.
+    an ordered stage returning True stops the ordered stages after it.
+    every other stage then runs concurrently and independently, like separate on_message listeners would,
+    so they see every message, even ones an ordered stage acted on, and a slow one doesn't hold up the rest.
+    stages only see messages from bots if added with bots=True, and dms if added with dms=True.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.stages = ()
+
+    def add(self, name: str, callback, priority: int = 50, bots=False, dms=False, ordered=False):
+        stages = [s for s in self.stages if s.name != name]
+        stages.append(PipelineStage(name, callback, priority, bots, dms, ordered))
+        stages.sort(key=lambda s: s.priority)
+        self.stages = tuple(stages)
+
+    def remove(self, name: str):
+        self.stages = tuple(s for s in self.stages if s.name != name)
+
+    async def build_context(self, message) -> MessageContext:
+        bot = self.bot
+        ctx = MessageContext(message)
+        if not ctx.is_dm:
+            config = ctx.config = bot.guild_configs.get(message.guild.id)
+            if config is not None:
+                ctx.automod_state = config.automod
+                ctx.logging_state = config.logging
+
+        if not ctx.is_bot:
+            ctx.prefix = bot.prefix_matcher(ctx.guild).match(ctx.content, ctx.author.id in bot.owner_ids)
+
+        return ctx
+
+    async def run_stage(self, stage: PipelineStage, ctx: MessageContext):
+        start = time.perf_counter()
+        try:
+            stop = await stage.callback(ctx)
+        except Exception:
+            await self.bot.on_error(f"pipeline stage {stage.name}", ctx.message)
+            stop = False
+
+        elapsed = time.perf_counter() - start
+        stage.calls += 1
+        stage.total += elapsed
+        if elapsed > stage.slowest:
+            stage.slowest = elapsed
+
+        return stop
+
+    async def dispatch(self, message):
+        ctx = await self.build_context(message)
+        stages = [s for s in self.stages if (s.bots or not ctx.is_bot) and (s.dms or not ctx.is_dm)]
+        for stage in stages:
+            if stage.ordered and await self.run_stage(stage, ctx):
+                break
+
+        others = [self.run_stage(stage, ctx) for stage in stages if not stage.ordered]
+        if others:
+            await asyncio.gather(*others)
 
 
 class Bot(commands.Bot):
@@ -122,20 +219,38 @@ class Bot(commands.Bot):
         self.session = aiohttp.ClientSession(loop=self.loop)
         self.highlight_cache = {}
         self.custom_flags = ["mute"]
-        self._custom_timers = []
-        self.custom_event_loop.start()
-        self.guild_prefixes = {}
-        self.guild_module_states = {}
-        self.guild_role_states = {}
+        # custom timers (ex. tempmutes), by uid. loaded from the timers table once the bot is ready
+        self.timers = scheduler.DueQueue(self.fire_timers, loop=self.loop)
+        self.loop.create_task(self.load_timers())
+        # guild id: GuildConfig. swapped out whole with update_config, never changed in place
+        self.guild_configs = objects.GuildConfigs()
+        # compiled from each guild's prefixes, by guild id (None for dms). rebuilt by rebuild_prefixes when they change
+        self.prefix_matchers = {}
         self.afks = {}
         self.timed_messages = {}
         self.uptime = 0
         self.logger, self.command_logger = logger, command_logger
         self.categories = {}
         self.bans = {}
-        self.automod_states = {}
-        self.logging_states = {}
+        # the automod and logging parts of the guild configs, for the cogs that keep them
+        self.automod_states = objects.GuildConfigView(self.guild_configs, "automod")
+        self.logging_states = objects.GuildConfigView(self.guild_configs, "logging")
         self.logging_ignore = []
+        # recent message ids by channel, so purges don't have to scan history
+        self.message_index = caches.MessageIndex()
+        # timing for automod and highlight matching, shared so the stats command can show overruns
+        self.rule_budget = trackers.RuleBudget()
+        # recent message content for delete/edit logs. the modlogs cog spills what falls out of it to the database
+        self.message_cache = caches.MessageCache()
+        # high volume inserts go through here, instead of a round trip per row
+        self.writer = batching.WriteBehind(self.pg, loop=self.loop)
+        self.writer.register("modlog_messages")
+        self.writer.register("moddata")
+        self.writer.register("talking_stats", "INSERT INTO talking_stats VALUES ($1,$2,1) ON CONFLICT (guild_id, user_id) "
+                                              "DO UPDATE SET messages = talking_stats.messages + 1;")
+        # every cog's message handling goes through here
+        self.pipeline = MessagePipeline(self)
+        self.pipeline.add("commands", self.run_commands, priority=100, dms=True)
         self.pings = collections.deque(maxlen=60)
         self.most_recent_change = self.changelog = None
         self.auths = {}
@@ -160,8 +275,57 @@ class Bot(commands.Bot):
                 return a,b
         return None, None
 
-    async def get_context(self, message, *, cls=None):
-        return await super().get_context(message, cls=cls or Contexter)
+    def update_config(self, guild_id: int, **changes):
+        """
+        swaps in a copy of a guild's config with some attributes changed
+        """
+        config = self.guild_configs.get(guild_id) or objects.GuildConfig(guild_id)
+        config = self.guild_configs[guild_id] = config.replace(**changes)
+        if "prefixes" in changes:
+            self.rebuild_prefixes(guild_id)
+
+        return config
+
+    def prefix_matcher(self, guild):
+        gid = guild.id if guild is not None else None
+        matcher = self.prefix_matchers.get(gid)
+        if matcher is None:
+            matcher = self.rebuild_prefixes(gid)
+
+        return matcher
+
+    def rebuild_prefixes(self, guild_id: int):
+        """
+        recompiles a guild's prefix matcher. update_config calls this when a guild's prefixes change
+        """
+        if guild_id is None:
+            matcher = matchers.PrefixMatcher(("!", "?", ""))
+        else:
+            mentions = (f"<@{self.user.id}> ", f"<@!{self.user.id}> ")
+            config = self.guild_configs.get(guild_id)
+            prefixes = config.prefixes if config is not None else ()
+            matcher = matchers.PrefixMatcher((*prefixes, *mentions), owner=("$",))
+
+        self.prefix_matchers[guild_id] = matcher
+        return matcher
+
+    async def get_context(self, message, *, cls=None, prefix=_unmatched):
+        cls = cls or Contexter
+        if prefix is _unmatched:
+            return await super().get_context(message, cls=cls)
+
+        # the prefix has already been matched, so skip straight to finding the command
+        view = StringView(message.content)
+        ctx = cls(prefix=None, view=view, bot=self, message=message)
+        if prefix is None or self._skip_check(message.author.id, self.user.id):
+            return ctx
+
+        view.skip_string(prefix)
+        invoker = view.get_word()
+        ctx.invoked_with = invoker
+        ctx.prefix = prefix
+        ctx.command = self.all_commands.get(invoker)
+        return ctx
 
     def reload_settings(self):
         with open("settings.json") as f:
@@ -169,7 +333,12 @@ class Bot(commands.Bot):
 
     async def close(self):
         await bot.session.close()
-        bot.custom_event_loop.cancel()
+        await self.timers.close()
+        modlogs = self.get_cog("_modlogs")
+        if modlogs is not None:
+            # cached messages are only written once they fall out of the cache, the rest would be lost on a restart
+            await modlogs.spill_messages(self.message_cache.drain())
+        await self.writer.close()
         lchan = self.get_channel(629167007807438858)
         await lchan.send(embed=commands.Embed(title="Disconnecting", color=commands.Color.dark_red()))
         await super().close()
@@ -183,16 +352,20 @@ class Bot(commands.Bot):
 
         self.loop.create_task(do_stuff())
 
-    @tasks.loop(seconds=1)
-    async def custom_event_loop(self):
-        now = calendar.timegm(datetime.datetime.utcnow().timetuple())
-        for gid, flag, expiry, uid, payload in self._custom_timers:
-            if expiry <= now:
-                data = json.loads(payload)
-                logger.debug("dispatching custom event: "+flag)
-                self.dispatch(flag, data)
-                self._custom_timers.remove((gid, flag, expiry, payload))
-                await self.pg.execute("DELETE FROM timers WHERE guild_id = $1 AND uid IS $2", (gid, uid))
+    async def load_timers(self):
+        await self.wait_until_ready()
+        for gid, flag, expiry, uid, payload in await self.pg.fetch("SELECT * FROM timers"):
+            if uid not in self.timers:
+                self.timers.schedule(uid, expiry, (flag, payload))
+
+        self.timers.start()
+
+    async def fire_timers(self, due):
+        for uid, (flag, payload) in due:
+            logger.debug("dispatching custom event: "+flag)
+            self.dispatch(flag, json.loads(payload))
+
+        await self.pg.execute("DELETE FROM timers WHERE uid = ANY($1::text[])", [uid for uid, _ in due])
 
     async def schedule_timer(self, gid: int, flag: str, expiry: tuple, FromDict: dict=None, *args, **kwargs):
         payload = {}
@@ -208,9 +381,10 @@ class Bot(commands.Bot):
         payload['guild_id'] = gid
         expiry = calendar.timegm(expiry)
         uid = str(uuid.uuid4())
-        await self.pg.execute("INSERT INTO timers VALUES ($1,$2,$3,$4,$5)", gid, flag, expiry, uid, json.dumps(payload, ensure_ascii=False))
-        # add it to a list so i dont have to make database calls every second in the custom event loop.
-        self._custom_timers.append((gid, flag, expiry, uid, json.dumps(payload, ensure_ascii=False)))
+        payload = json.dumps(payload, ensure_ascii=False)
+        await self.pg.execute("INSERT INTO timers VALUES ($1,$2,$3,$4,$5)", gid, flag, expiry, uid, payload)
+        self.timers.schedule(uid, expiry, (flag, payload))
+        return uid
 
     def get_category(self, name):
         return self.categories.get(name)
@@ -232,28 +406,30 @@ class Bot(commands.Bot):
         return self.categories.pop(name)
 
     async def on_message(self, message):
-        if message.author.bot or not bot.is_ready() or not bot.setup:
+        if message.guild is not None:
+            self.message_index.add(message)
+
+        if not bot.is_ready() or not bot.setup:
             return
 
-        curr = self.get_cog("Currency")
+        await self.pipeline.dispatch(message)
 
-        if curr is not None:
-            curr.activity.update_rate_limit(message)
+    async def run_commands(self, ctx: MessageContext):
+        context = await self.get_context(ctx.message, prefix=ctx.prefix)
 
-        if message.guild.id not in self.logging_states:
-            rec = await self.pg.fetchrow("SELECT * FROM modlogs WHERE guild_id = $1;", message.guild.id)
-            if not rec:
-                self.logging_states[message.guild.id] = None
+        if context.command is None and self.user in ctx.message.mentions:
+            await self.get_cog("Bull").run_ping(context)
 
-            else:
-                self.logging_states[message.guild.id] = objects.LoggingFlags(self.pg, rec)
+        await self.invoke(context)
 
-        ctx = await self.get_context(message)
+    async def on_raw_message_delete(self, payload):
+        self.message_index.remove(payload.channel_id, (payload.message_id,))
 
-        if ctx.command is None and self.user in message.mentions:
-            await self.get_cog("Bull").run_ping(ctx)
+    async def on_raw_bulk_message_delete(self, payload):
+        self.message_index.remove(payload.channel_id, payload.message_ids)
 
-        await self.invoke(ctx)
+    async def on_guild_channel_delete(self, channel):
+        self.message_index.drop(channel.id)
 
     async def on_command(self, ctx):
         command_logger.info(
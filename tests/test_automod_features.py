@@ -0,0 +1,93 @@
+import importlib
+import os
+
+import discord
+import pytest
+
+from utils import objects
+
+
+class State:
+    """
+    just enough of discord.py's connection state to build messages with
+    """
+    def store_user(self, data):
+        return discord.User(state=self, data=data)
+
+
+@pytest.fixture(scope="module")
+def automod_exec(tmp_path_factory):
+    # the cog loads the default word list from a path relative to the working directory
+    path = tmp_path_factory.mktemp("bob")
+    (path / "data").mkdir()
+    (path / "data" / "default_wordlist.txt").write_text("badword\n")
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield importlib.import_module("Cogs.automod_exec")
+    finally:
+        os.chdir(cwd)
+
+
+def make_message(content, mentions=()):
+    author = {"id": "1", "username": "someone", "discriminator": "0001", "avatar": None}
+    data = {
+        "id": "100",
+        "attachments": [],
+        "embeds": [],
+        "edited_timestamp": None,
+        "type": 0,
+        "pinned": False,
+        "mention_everyone": False,
+        "tts": False,
+        "content": content,
+        "author": author,
+        "mentions": [{"id": str(i), "username": f"user{i}", "discriminator": "0001", "avatar": None} for i in mentions],
+        "mention_roles": [],
+    }
+    return discord.Message(state=State(), channel=None, data=data)
+
+
+def test_features_from_message(automod_exec):
+    message = make_message("LOOK at https://example.com and discord.gg/abc, badword <@2>", mentions=(2,))
+    features = automod_exec.MessageFeatures(message, objects.AutomodLevels.all())
+
+    assert features.length == len(message.content)
+    assert features.mentions == 1
+    assert features.caps == 4
+    assert features.hosts == ["example.com"]
+    assert features.invite is not None
+    assert features.text
+    assert set(features.cost) == {"run_allow_links", "run_allow_discord_invites", "run_banned_words"}
+
+
+def test_features_skip_disabled_rules(automod_exec):
+    message = make_message("https://example.com")
+    features = automod_exec.MessageFeatures(message, objects.AutomodLevels.none())
+
+    assert features.hosts == ()
+    assert features.cost == {}
+
+
+def test_features_survive_unparseable_links(automod_exec):
+    message = make_message("http://[x badword https://example.com <@2> <@3>", mentions=(2, 3))
+    features = automod_exec.MessageFeatures(message, objects.AutomodLevels.all())
+
+    assert features.hosts == ["example.com"]
+    assert features.mentions == 2
+    assert features.text
+
+
+def test_features_scan_long_messages_whole(automod_exec):
+    message = make_message("x" * 600 + " discord.gg/abcdef https://evil.com badword " + "y" * 600)
+    features = automod_exec.MessageFeatures(message, objects.AutomodLevels.all())
+
+    assert features.invite is not None
+    assert features.hosts == ["evil.com"]
+    assert "badword" in features.text
+
+    # once the word rule is degraded, only its matching is cut short
+    features = automod_exec.MessageFeatures(message, objects.AutomodLevels.all(), word_limit=256)
+    assert features.invite is not None
+    assert features.hosts == ["evil.com"]
+    assert "badword" not in features.text
@@ -0,0 +1,83 @@
+import asyncio
+
+import asyncpg
+
+from utils.batching import WriteBehind
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class Connection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def copy_records_to_table(self, table, records):
+        self.pool.attempts += 1
+        if self.pool.down:
+            self.pool.down -= 1
+            raise ConnectionResetError()
+
+        if any(row is None for row in records):
+            # what asyncpg raises client side when a row doesn't fit the columns
+            raise asyncpg.exceptions._base.DataError("invalid input for query argument")
+
+        self.pool.rows.extend(records)
+
+
+class Pool:
+    def __init__(self, down=0):
+        self.down = down
+        self.attempts = 0
+        self.rows = []
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return Connection(pool)
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+def test_bad_rows_only_lose_themselves():
+    async def main():
+        pool = Pool()
+        writer = WriteBehind(pool, delay=60, loop=asyncio.get_event_loop())
+        writer.register("table")
+        for row in [(1,), None, (2,), (3,), None, (4,)]:
+            writer.put_nowait("table", row)
+
+        await writer.close()
+        return pool, writer
+
+    pool, writer = run(main())
+    assert pool.rows == [(1,), (2,), (3,), (4,)]
+    assert writer.written == 4 and writer.failed == 2 and writer.pending == 0
+
+
+def test_connection_errors_are_retried(monkeypatch):
+    async def sleep(_):
+        pass
+
+    async def main():
+        pool = Pool(down=2)
+        writer = WriteBehind(pool, delay=60, loop=asyncio.get_event_loop())
+        monkeypatch.setattr(asyncio, "sleep", sleep)
+        writer.register("table")
+        writer.put_nowait("table", (1,))
+        await writer.close()
+        return pool, writer
+
+    pool, writer = run(main())
+    assert pool.rows == [(1,)]
+    assert pool.attempts == 3 and writer.failed == 0
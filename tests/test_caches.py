@@ -0,0 +1,44 @@
+import datetime
+import types
+
+import discord
+
+from utils.caches import CachedMessage, MessageCache, RecentMessage, RecentMessages, split_by_age
+
+
+def test_split_by_age():
+    now = datetime.datetime(2021, 1, 30)
+    new = discord.utils.time_snowflake(now - datetime.timedelta(days=1))
+    old = discord.utils.time_snowflake(now - datetime.timedelta(days=15))
+    assert split_by_age([new, old, new + 1], now=now) == ([new, new + 1], [old])
+
+
+def test_recent_messages_keep_only_fields():
+    channel = types.SimpleNamespace(id=1)
+    author = types.SimpleNamespace(id=2)
+    messages = [types.SimpleNamespace(id=i, channel=channel, author=author, content=str(i),
+                                      created_at=datetime.datetime(2021, 1, 1)) for i in range(10, 15)]
+    recent = RecentMessages(per_channel=4)
+    for m in messages:
+        recent.add(m)
+
+    stored = list(recent.get(1))
+    assert [m.id for m in stored] == [11, 12, 13, 14]
+    assert all(type(m) is RecentMessage and m.author_id == 2 for m in stored)
+    assert not hasattr(stored[0], "__dict__")
+    assert [m.id for m in recent.around(messages[2], 1, 1)] == [11, 12, 13]
+
+    recent.remove(1, (12,))
+    assert [m.content for m in recent.get(1)] == ["11", "13", "14"]
+
+
+def test_message_cache_drain():
+    evicted = []
+    cache = MessageCache(on_evict=evicted.append)
+    for i in range(3):
+        cache.put(CachedMessage(1, 2, i, 3, None, f"message {i}"))
+
+    entries = cache.drain()
+    assert [entry.message_id for entry in entries] == [0, 1, 2]
+    assert len(cache) == 0 and cache.nbytes == 0
+    assert evicted == []
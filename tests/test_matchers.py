@@ -0,0 +1,106 @@
+import pytest
+
+from utils.matchers import DomainIndex, PrefixMatcher, WordFilter, scan_window
+
+
+def test_scan_window_keeps_text_without_a_limit():
+    assert scan_window("hello") == "hello"
+    assert scan_window("a" * 5000) == "a" * 5000
+    assert scan_window("hello", 256) == "hello"
+
+
+def test_scan_window_bounds_long_text():
+    text = "a" * 3000 + " badword"
+    window = scan_window(text, 256)
+    assert len(window) <= 257
+    # padding the start of a message doesn't hide what's at the end
+    assert WordFilter(["badword"]).search(window) is not None
+
+
+def test_word_filter_len_tracks_changes():
+    words = WordFilter(["badword", "b4dword", "other"])
+    assert len(words) == 3
+    words.add("other")
+    assert len(words) == 3
+    words.remove("b4dword")
+    assert len(words) == 2 and words
+    words.remove("badword")
+    words.remove("other")
+    assert len(words) == 0 and not words
+
+
+def test_domain_index_blocks_subdomains():
+    index = DomainIndex(["example.com"])
+    assert index.search("example.com") == "example.com"
+    assert index.search("cdn.EXAMPLE.com.") == "example.com"
+    assert index.search("notexample.com") is None
+    assert index.search("com") is None
+
+
+def test_domain_index_allow_beats_block():
+    index = DomainIndex(["example.com", "!good.example.com"])
+    assert index.search("good.example.com") is None
+    assert index.search("cdn.good.example.com") is None
+    assert index.search("bad.example.com") == "example.com"
+
+    # an allow entry for the same domain wins too
+    index.add("!example.com")
+    assert index.search("example.com") is None
+
+
+def test_domain_index_wildcard_skips_the_apex():
+    index = DomainIndex(["*.example.org"])
+    assert index.search("example.org") is None
+    assert index.search("a.example.org") == "*.example.org"
+    assert index.search("a.b.example.org") == "*.example.org"
+
+
+def test_domain_index_normalizes_idna():
+    index = DomainIndex()
+    assert index.add("https://BÜCHER.de/path") == "xn--bcher-kva.de"
+    assert index.search("bücher.de") == "xn--bcher-kva.de"
+    assert index.search("www.xn--bcher-kva.de") == "xn--bcher-kva.de"
+    assert "bücher.de" in index
+
+
+def test_domain_index_remove_recomputes_the_node():
+    index = DomainIndex(["example.com", "*.example.com"])
+    index.remove("example.com")
+    assert index.search("example.com") is None
+    assert index.search("sub.example.com") == "*.example.com"
+
+    index.remove("*.example.com")
+    assert index.search("sub.example.com") is None
+    assert len(index) == 0
+
+
+def test_domain_index_rejects_bad_input():
+    assert DomainIndex.parse("http://[x") is None
+    with pytest.raises(ValueError):
+        DomainIndex().add("http://[x")
+
+
+def test_prefix_matcher_prefers_the_longest_prefix():
+    for prefixes in (["!", "!!", "?"], ["!!", "?", "!"]):
+        matcher = PrefixMatcher(prefixes)
+        assert matcher.match("!!help") == "!!"
+        assert matcher.match("!help") == "!"
+        assert matcher.match("?help") == "?"
+        assert matcher.match("help") is None
+        assert matcher.match("") is None
+
+
+def test_prefix_matcher_empty_prefix_matches_everything():
+    matcher = PrefixMatcher(["", "!"])
+    assert matcher.match("!help") == "!"
+    assert matcher.match("help") == ""
+    assert matcher.match("") == ""
+
+
+def test_prefix_matcher_owner_prefixes():
+    matcher = PrefixMatcher(["!"], owner=["$"])
+    assert matcher.match("$eval") is None
+    assert matcher.match("$eval", owner=True) == "$"
+    assert matcher.match("!help", owner=True) == "!"
+    assert matcher.get() == ("!",)
+    assert set(matcher.get(owner=True)) == {"!", "$"}
@@ -0,0 +1,45 @@
+from utils import objects
+
+
+def test_module_flags_round_trip():
+    flags = "1" * 15 + "1" + "0"
+    modules = objects.modules_from_flags(flags)
+    assert objects.flags_from_modules(modules) == flags
+    config = objects.GuildConfig(1, modules)
+    assert config.has_module("moderation")
+    assert not config.has_module("highlight")
+    assert objects.GuildConfig(1, config.module_mask("highlight", True)).has_module("highlight")
+
+
+def test_view_counts_follow_the_configs():
+    configs = objects.GuildConfigs()
+    automod = objects.GuildConfigView(configs, "automod")
+    configs[1] = objects.GuildConfig(1)
+    configs[2] = objects.GuildConfig(2, automod="state")
+    assert len(automod) == 1 and 2 in automod and 1 not in automod
+
+    automod[1] = "other"
+    assert len(automod) == 2 and configs[1].automod == "other"
+
+    configs[2] = configs[2].replace(automod=None)
+    assert len(automod) == 1
+
+    configs.pop(1)
+    configs.pop(1, None)
+    assert len(automod) == 0 and dict(automod) == {}
+
+    automod[3] = "new"
+    del automod[3]
+    assert len(automod) == 0 and 3 in configs
+
+
+def test_auto_raidmode_is_opt_in():
+    state = objects.AutomodLevels("3333333")
+    assert state.auto_raidmode == 0
+    snapshot = state.snapshot()
+
+    state.auto_raidmode = 1
+    assert state.value == "33333331"
+    state.raidmode_strict()
+    assert state.auto_raidmode == 1
+    assert state.restore(snapshot).value == "3333333"
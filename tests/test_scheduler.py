@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from utils.scheduler import DueQueue
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_reschedule_replaces_the_old_entry():
+    async def main():
+        fired = []
+
+        async def callback(due):
+            fired.extend(due)
+
+        queue = DueQueue(callback, loop=asyncio.get_event_loop())
+        now = time.time()
+        queue.schedule("a", now + 0.05, 1)
+        queue.schedule("a", now + 0.2, 2)
+        queue.schedule("b", now + 0.1, 3)
+        queue.start()
+
+        await asyncio.sleep(0.15)
+        assert fired == [("b", 3)]
+        await asyncio.sleep(0.15)
+        assert fired == [("b", 3), ("a", 2)]
+
+        # the runner survived, and still fires new items
+        queue.schedule("c", time.time(), 4)
+        await asyncio.sleep(0.05)
+        assert fired[-1] == ("c", 4)
+        assert len(queue) == 0
+        await queue.close()
+
+    run(main())
+
+
+def test_cancel():
+    async def main():
+        fired = []
+
+        async def callback(due):
+            fired.extend(due)
+
+        queue = DueQueue(callback, loop=asyncio.get_event_loop())
+        queue.schedule("a", time.time() + 0.05)
+        queue.start()
+        assert queue.cancel("a")
+        assert not queue.cancel("a")
+        await asyncio.sleep(0.1)
+        assert fired == []
+        await queue.close()
+
+    run(main())
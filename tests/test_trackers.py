@@ -0,0 +1,69 @@
+import types
+
+from utils.trackers import RuleBudget, SpamTracker
+
+
+def test_slow_rule_is_degraded_not_skipped():
+    budget = RuleBudget(budget=0.005, trips=3, per=60, cooldown=300, degraded_length=256)
+    assert budget.scan_length(1, "rule", now=0) is None
+
+    tripped = [budget.record(1, "rule", 0.01, now=t) for t in (1, 2, 3)]
+    assert tripped == [False, False, True]
+    assert budget.scan_length(1, "rule", now=4) == 256
+    # other guilds and rules aren't affected
+    assert budget.scan_length(2, "rule", now=4) is None
+    assert budget.scan_length(1, "other", now=4) is None
+    # and it goes back to normal after the cooldown
+    assert budget.scan_length(1, "rule", now=304) is None
+
+
+def test_drop_and_evict():
+    budget = RuleBudget()
+    budget.record(1, "rule", 1, now=0)
+    budget.record(2, "rule", 1, now=0)
+    budget.drop(1)
+    assert budget.evict(now=1) == 0
+    assert budget.evict(now=1000) == 1
+
+
+def message(user, content="hello", guild=1):
+    return types.SimpleNamespace(guild=types.SimpleNamespace(id=guild), author=types.SimpleNamespace(id=user), content=content)
+
+
+def test_spam_windows_are_per_user():
+    spam = SpamTracker(rules=((8, 4), (25, 15)), duplicates=(4, 30))
+    for i in range(7):
+        assert spam.hit(message(1, f"first {i}"), now=i * 0.1) is None
+        assert spam.hit(message(2, f"second {i}"), now=i * 0.1) is None
+        # same user id, different guild
+        assert spam.hit(message(1, f"third {i}", guild=2), now=i * 0.1) is None
+
+    assert spam.hit(message(1, "first 7"), now=0.7) == ("Sent 8 messages in 4 seconds", 8)
+    assert spam.hit(message(2, "second 7"), now=0.7) is not None
+    # triggering resets the window
+    assert spam.hit(message(1, "first 8"), now=0.8) is None
+
+
+def test_spam_catches_duplicates():
+    spam = SpamTracker(rules=((8, 4), (25, 15)), duplicates=(4, 30), min_length=10)
+    for i in range(3):
+        assert spam.hit(message(1, "buy my stuff now"), now=i * 5) is None
+
+    # case doesn't matter
+    assert spam.hit(message(1, "BUY MY STUFF NOW"), now=15) == ("Sent the same message 4 times in 30 seconds", 4)
+
+    # short messages are never duplicates
+    for i in range(6):
+        assert spam.hit(message(2, "lol"), now=i * 5) is None
+
+
+def test_spam_evicts_idle_users():
+    spam = SpamTracker(idle=60)
+    spam.hit(message(1), now=0)
+    spam.hit(message(2), now=50)
+    assert len(spam) == 2
+
+    assert spam.evict(now=70) == 1
+    assert len(spam) == 1
+    assert spam.evict(now=200) == 1
+    assert len(spam) == 0
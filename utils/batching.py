@@ -0,0 +1,260 @@
+import asyncio
+import traceback
+
+import asyncpg
+
+__all__ = ["Batcher", "WriteBehind"]
+
+
+class Batcher:
+    """
+    collects items per key, and hands them to `callback(key, items)` in batches.
+    a key's batch is flushed `delay` seconds after its first item arrives, or as soon as it holds `max_items`.
+    batches for the same key are always handled one at a time, in the order they were filled,
+    and at most `concurrency` batches (across all keys) are handled at once.
+    once `max_pending` items are waiting, new items are dropped instead of letting memory grow.
+    """
+    def __init__(self, callback, delay: float = 1.0, max_items: int = 100, concurrency: int = 4,
+                 max_pending: int = 10000, loop=None):
+        self.callback = callback
+        self.delay = delay
+        self.max_items = max_items
+        self.max_pending = max_pending
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = 0
+        self.dropped = 0
+        self.flushed = 0
+        self._buffers = {}
+        self._timers = {}
+        self._locks = {}
+        self._tasks = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def __len__(self):
+        return self.pending
+
+    @property
+    def in_flight(self) -> int:
+        """
+        how many batches are being handled (or waiting for their turn) right now
+        """
+        return len(self._tasks)
+
+    def add(self, key, item) -> bool:
+        """
+        queues an item. returns False if it was dropped because too much is already waiting
+        """
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            return False
+
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = []
+
+        buffer.append(item)
+        self.pending += 1
+
+        if len(buffer) >= self.max_items:
+            self._schedule(key)
+        elif key not in self._timers:
+            self._timers[key] = self.loop.call_later(self.delay, self._schedule, key)
+
+        return True
+
+    def _schedule(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        items = self._buffers.pop(key, None)
+        if not items:
+            return
+
+        self.pending -= len(items)
+        # grab the key's lock slot now, so batches queue up on it in the order they were taken
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = [asyncio.Lock(), 0]
+
+        lock[1] += 1
+        task = self.loop.create_task(self._run(key, items, lock))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, items, lock):
+        try:
+            async with lock[0]:
+                async with self._semaphore:
+                    try:
+                        await self.callback(key, items)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        traceback.print_exc()
+                    finally:
+                        self.flushed += len(items)
+        finally:
+            lock[1] -= 1
+            if not lock[1]:
+                del self._locks[key]
+
+    async def flush(self, key=None):
+        """
+        flushes one key (or every key) right away, and waits for everything in flight to finish
+        """
+        for k in ([key] if key is not None else list(self._buffers)):
+            self._schedule(k)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+
+
+class WriteBehind:
+    """
+    buffers rows per table, and writes them in bulk: with COPY for plain inserts,
+    or one executemany for tables registered with a query (ex. upserts).
+    each table is written every `delay` seconds, or as soon as it has `max_rows` rows waiting.
+    once `max_pending` rows are waiting in total, `put` waits for the writer to catch up, and `put_nowait` drops the row.
+    writes that fail because the database couldn't be reached are retried up to `retries` times before being dropped.
+    any other failure is bad data, and the batch is split until only the rows that fail on their own are dropped.
+    """
+    # only what means the database couldn't be reached. asyncpg's client side DataError is an InterfaceError, for one
+    RETRYABLE = (
+        OSError,
+        asyncio.TimeoutError,
+        asyncpg.PostgresConnectionError,
+        asyncpg.CannotConnectNowError,
+        asyncpg.TooManyConnectionsError,
+        asyncpg.AdminShutdownError,
+        asyncpg.CrashShutdownError,
+    )
+
+    def __init__(self, pool, delay: float = 2.0, max_rows: int = 1000, max_pending: int = 50000, retries: int = 3, loop=None):
+        self.pool = pool
+        self.delay = delay
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self.retries = retries
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queries = {}
+        self._buffers = {}
+        self._wake = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self._task = self.loop.create_task(self._run())
+
+    def __len__(self):
+        return self.pending
+
+    def register(self, table: str, query: str = None):
+        """
+        registers a table. rows for tables without a query are written with COPY, in the table's column order
+        """
+        self._queries[table] = query
+        self._buffers.setdefault(table, [])
+
+    def put_nowait(self, table: str, row: tuple) -> bool:
+        """
+        queues a row. returns False if it was dropped because the writer is too far behind
+        """
+        if self.pending >= self.max_pending:
+            self.dropped += 1
+            return False
+
+        self._append(table, row)
+        return True
+
+    async def put(self, table: str, row: tuple):
+        """
+        queues a row, waiting for room if the writer is too far behind
+        """
+        while self.pending >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+
+        self._append(table, row)
+
+    def _append(self, table, row):
+        buffer = self._buffers[table]
+        buffer.append(row)
+        self.pending += 1
+        if len(buffer) >= self.max_rows:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.delay)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    async def flush(self):
+        """
+        writes everything that's waiting right now
+        """
+        async with self._lock:
+            # a table can be registered while this is waiting on a write
+            for table, buffer in list(self._buffers.items()):
+                while buffer:
+                    rows = buffer[:self.max_rows]
+                    del buffer[:self.max_rows]
+                    await self._write(table, rows)
+                    self.pending -= len(rows)
+                    if self.pending < self.max_pending:
+                        self._space.set()
+
+    async def _write(self, table, rows):
+        query = self._queries[table]
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.pool.acquire() as conn:
+                    if query is None:
+                        await conn.copy_records_to_table(table, records=rows)
+                    else:
+                        await conn.executemany(query, rows)
+            except self.RETRYABLE:
+                if attempt == self.retries:
+                    traceback.print_exc()
+                    break
+
+                await asyncio.sleep(2 ** attempt)
+            except (asyncpg.PostgresError, asyncpg.InterfaceError):
+                # bad data won't get any better by retrying. halving the batch narrows it down to the bad rows
+                if len(rows) == 1:
+                    traceback.print_exc()
+                    break
+
+                half = len(rows) // 2
+                await self._write(table, rows[:half])
+                await self._write(table, rows[half:])
+                return
+            else:
+                self.written += len(rows)
+                return
+
+        self.failed += len(rows)
+
+    async def close(self):
+        """
+        stops the background writer, and writes whatever is left
+        """
+        self._closed = True
+        self._wake.set()
+        await self._task
+        await self.flush()
@@ -0,0 +1,368 @@
+import asyncio
+import collections
+import datetime
+import sys
+import time
+
+import discord
+
+__all__ = ["MessageIndex", "RecentMessages", "RecentMessage", "CachedMessage", "MessageCache", "AuditLogCache", "split_by_age"]
+
+# discord refuses to bulk delete anything older than this. a minute of slack covers clock drift and slow requests
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14, minutes=-1)
+
+
+class MessageIndex:
+    """
+    remembers the ids (and authors) of the most recent messages in each channel, as they come in from the gateway.
+    each channel keeps at most `per_channel` messages, and the least recently active channels are dropped
+    once more than `max_channels` are being tracked.
+    this lets purges go straight to a bulk delete, instead of paging through the channel history to find messages.
+    each indexed message costs about 120 bytes, so the defaults come to roughly 50mb once every slot is in use.
+    automod purges only need the last 25 messages and `remove` defaults to 100, anything bigger falls back to the history.
+    """
+    def __init__(self, per_channel: int = 200, max_channels: int = 2000):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self._channels = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def add(self, message):
+        channel = self._channels.get(message.channel.id)
+        if channel is None:
+            channel = self._channels[message.channel.id] = collections.OrderedDict()
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(message.channel.id)
+
+        channel[message.id] = message.author.id
+        if len(channel) > self.per_channel:
+            channel.popitem(last=False)
+
+    def remove(self, channel_id: int, message_ids):
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return
+
+        for message_id in message_ids:
+            channel.pop(message_id, None)
+
+    def drop(self, channel_id: int):
+        self._channels.pop(channel_id, None)
+
+    def search(self, channel_id: int, limit: int, author_id: int = None, before: int = None):
+        """
+        the same thing `channel.purge(limit=limit, before=before, check=...)` would find:
+        ids of messages by `author_id` (or anyone) among the last `limit` messages in the channel, newest first.
+        returns None if the channel isn't indexed far enough back to know for sure.
+        """
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return None
+
+        found = []
+        scanned = 0
+        for message_id in reversed(channel):
+            if before is not None and message_id >= before:
+                continue
+
+            if scanned >= limit:
+                break
+
+            scanned += 1
+            if author_id is None or channel[message_id] == author_id:
+                found.append(message_id)
+        else:
+            if scanned < limit:
+                # ran out of indexed messages, there may be older ones we never saw
+                return None
+
+        return found
+
+
+def split_by_age(message_ids, now: datetime.datetime = None):
+    """
+    splits message ids into the ones that can be bulk deleted, and the ones too old for it, which have to be deleted one by one.
+    a bulk delete with a single message that's too old fails entirely, so ids from the index need to go through this first
+    """
+    cutoff = (now or datetime.datetime.utcnow()) - BULK_DELETE_MAX_AGE
+    recent, old = [], []
+    for message_id in message_ids:
+        (recent if discord.utils.snowflake_time(message_id) > cutoff else old).append(message_id)
+
+    return recent, old
+
+
+class RecentMessage:
+    """
+    the parts of a message RecentMessages keeps, so buffered messages don't hold on to their author, channel, embeds etc.
+    """
+    __slots__ = ("id", "author_id", "author_name", "content", "created_at")
+
+    def __init__(self, id, author_id, author_name, content, created_at):
+        self.id = id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+        self.created_at = created_at
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.id, message.author.id, str(message.author), message.content, message.created_at)
+
+
+class RecentMessages:
+    """
+    the last `per_channel` messages of each channel, as they come in from the gateway, stored as RecentMessage.
+    only the `max_channels` most recently active channels are kept.
+    """
+    def __init__(self, per_channel: int = 50, max_channels: int = 2000):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self._channels = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._channels)
+
+    def add(self, message):
+        channel = self._channels.get(message.channel.id)
+        if channel is None:
+            channel = self._channels[message.channel.id] = collections.deque(maxlen=self.per_channel)
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(message.channel.id)
+
+        channel.append(RecentMessage.from_message(message))
+
+    def remove(self, channel_id: int, message_ids):
+        channel = self._channels.get(channel_id)
+        if not channel:
+            return
+
+        message_ids = set(message_ids)
+        kept = [m for m in channel if m.id not in message_ids]
+        if len(kept) != len(channel):
+            channel.clear()
+            channel.extend(kept)
+
+    def get(self, channel_id: int):
+        """
+        the buffered messages of a channel, oldest first. empty if the channel isn't being tracked
+        """
+        return self._channels.get(channel_id, ())
+
+    def around(self, message, before: int, after: int):
+        """
+        the `before` messages before `message`, the message itself, and up to `after` messages after it.
+        returns None if the buffer doesn't go back far enough
+        """
+        channel = self._channels.get(message.channel.id)
+        if not channel:
+            return None
+
+        messages = list(channel)
+        for index, m in enumerate(messages):
+            if m.id == message.id:
+                break
+        else:
+            return None
+
+        if index < before:
+            return None
+
+        return messages[index - before:index + after + 1]
+
+
+class CachedMessage:
+    __slots__ = ("guild_id", "channel_id", "message_id", "user_id", "created_at", "content")
+
+    def __init__(self, guild_id, channel_id, message_id, user_id, created_at, content):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.created_at = created_at
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.guild.id, message.channel.id, message.id, message.author.id, message.created_at, message.content)
+
+    def record(self):
+        """
+        the row for the modlog_messages table
+        """
+        return self.guild_id, self.channel_id, self.message_id, self.user_id, self.created_at, self.content
+
+
+class MessageCache:
+    """
+    an lru of recent message content, by message id, capped at roughly `max_bytes` of memory.
+    when a message falls out, it's handed to `on_evict` (if set), which can spill it somewhere slower.
+    """
+    # what a cached message costs besides its content: the object, its ints and datetime, and the dict entry
+    ENTRY_OVERHEAD = 300
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.nbytes = 0
+        self.evicted = 0
+        self._messages = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __contains__(self, message_id):
+        return message_id in self._messages
+
+    @classmethod
+    def _size(cls, entry):
+        return sys.getsizeof(entry.content) + cls.ENTRY_OVERHEAD
+
+    def add(self, message):
+        self.put(CachedMessage.from_message(message))
+
+    def put(self, entry: CachedMessage):
+        old = self._messages.pop(entry.message_id, None)
+        if old is not None:
+            self.nbytes -= self._size(old)
+
+        self._messages[entry.message_id] = entry
+        self.nbytes += self._size(entry)
+
+        while self.nbytes > self.max_bytes and self._messages:
+            _, evicted = self._messages.popitem(last=False)
+            self.nbytes -= self._size(evicted)
+            self.evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def get(self, message_id: int):
+        entry = self._messages.get(message_id)
+        if entry is not None:
+            self._messages.move_to_end(message_id)
+
+        return entry
+
+    def pop(self, message_id: int):
+        entry = self._messages.pop(message_id, None)
+        if entry is not None:
+            self.nbytes -= self._size(entry)
+
+        return entry
+
+    def update(self, message_id: int, content: str):
+        entry = self._messages.get(message_id)
+        if entry is None:
+            return
+
+        self.nbytes += sys.getsizeof(content) - sys.getsizeof(entry.content)
+        entry.content = content
+        self._messages.move_to_end(message_id)
+
+    def drain(self) -> list:
+        """
+        empties the cache, and returns what was in it, oldest first. `on_evict` isn't called for these
+        """
+        entries = list(self._messages.values())
+        self._messages.clear()
+        self.nbytes = 0
+        return entries
+
+
+class AuditLogCache:
+    """
+    the recent audit log entries of each guild, for figuring out who did something.
+    `find` looks through what's cached first, and only fetches the guild's audit log when nothing matches.
+    a fetch grabs the latest `limit` entries of every action, so one request can answer a whole burst of events.
+    concurrent lookups in a guild share a single fetch, and a guild is fetched at most once every `min_interval` seconds.
+    """
+    def __init__(self, window: float = 10, limit: int = 50, min_interval: float = 1.0, loop=None):
+        self.window = window
+        self.limit = limit
+        self.min_interval = min_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.fetches = 0
+        self.hits = 0
+        self._entries = {} # guild id: {entry id: [entry, when it last changed]}
+        self._fetching = {}
+        self._last_fetch = {}
+
+    def _match(self, guild_id, actions, target_id, check):
+        entries = self._entries.get(guild_id)
+        if not entries:
+            return None
+
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.window)
+        for entry, updated in entries.values():
+            if updated < cutoff or entry.action not in actions:
+                continue
+
+            if getattr(entry.target, "id", None) != target_id:
+                continue
+
+            if check is not None and not check(entry):
+                continue
+
+            return entry
+
+        return None
+
+    async def find(self, guild, actions, target_id: int, check=None):
+        """
+        the most recent entry of one of the `actions` that targeted `target_id` within the window, or None.
+        `check` can filter entries further, ex. by the channel of a message delete
+        """
+        entry = self._match(guild.id, actions, target_id, check)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        task = self._fetching.get(guild.id)
+        if task is None:
+            task = self._fetching[guild.id] = self.loop.create_task(self._fetch(guild))
+            task.add_done_callback(lambda _: self._fetching.pop(guild.id, None))
+
+        await asyncio.shield(task)
+        return self._match(guild.id, actions, target_id, check)
+
+    async def _fetch(self, guild):
+        wait = self._last_fetch.get(guild.id, 0) + self.min_interval - time.monotonic()
+        if wait > 0:
+            # the entry we're looking for might not have been written yet, no point in asking again right away
+            await asyncio.sleep(wait)
+
+        self._last_fetch[guild.id] = time.monotonic()
+        self.fetches += 1
+        try:
+            fetched = await guild.audit_logs(limit=self.limit).flatten()
+        except discord.HTTPException:
+            return
+
+        old = self._entries.get(guild.id, {})
+        now = datetime.datetime.utcnow()
+        entries = {}
+        for entry in fetched:
+            updated = entry.created_at
+            previous = old.get(entry.id)
+            if previous is not None:
+                updated = previous[1]
+                # repeated message deletes get folded into the same entry, with a higher count
+                if getattr(previous[0].extra, "count", None) != getattr(entry.extra, "count", None):
+                    updated = now
+
+            entries[entry.id] = [entry, updated]
+
+        self._entries[guild.id] = entries
+
+    def drop(self, guild_id: int):
+        self._entries.pop(guild_id, None)
+        self._last_fetch.pop(guild_id, None)
@@ -29,9 +29,9 @@ async def basic_check(ctx, mode, higher="editor"):
     if ctx.author.guild_permissions.administrator:
         return True
     try:
-        v = ctx.bot.guild_role_states[ctx.guild.id][mode]
-        role = ctx.guild.get_role(v)
-        v = ctx.bot.guild_role_states[ctx.guild.id][higher]
+        config = ctx.bot.guild_configs[ctx.guild.id]
+        role = ctx.guild.get_role(config.role(mode))
+        v = config.role(higher)
         higherrole = ctx.guild.get_role(v)
         if not role:
             raise RoleDoesNotExist(f"The {mode} role could not be found. Are you sure you have a role set up for that?")
@@ -72,8 +72,9 @@ def check_moderator():
             return True
         if ctx.author.guild_permissions.administrator:
             return True
-        role = ctx.guild.get_role(ctx.bot.guild_role_states[ctx.guild.id]['moderator'])
-        higherrole = ctx.guild.get_role(ctx.bot.guild_role_states[ctx.guild.id]['editor'])
+        config = ctx.bot.guild_configs[ctx.guild.id]
+        role = ctx.guild.get_role(config.moderator)
+        higherrole = ctx.guild.get_role(config.editor)
         if not role:
             raise RoleDoesNotExist(f"The Moderator role could not be found. Are you sure you have a role set up for that?")
         if role not in ctx.author.roles and higherrole not in ctx.author.roles:
@@ -89,7 +90,7 @@ def check_editor():
             return True
         if ctx.author.guild_permissions.administrator:
             return True
-        role = ctx.bot.guild_role_states[ctx.guild.id]['moderator']
+        role = ctx.bot.guild_configs[ctx.guild.id].moderator
         role = ctx.guild.get_role(role)
         if not role:
             raise RoleDoesNotExist(f"The Editor role could not be found. Are you sure you have a role set up for that?")
@@ -117,7 +118,7 @@ def check_manager():
 
 def check_module(module: str):
     async def predicate(ctx):
-        if not ctx.bot.guild_module_states[ctx.guild.id][module]:
+        if not ctx.bot.guild_configs[ctx.guild.id].has_module(module):
             raise errors.ModuleDisabled(module)
         return True
     return commands.check(predicate)
\ No newline at end of file
@@ -0,0 +1,539 @@
+import collections
+import itertools
+import unicodedata
+
+import yarl
+
+__all__ = ["Automaton", "WordFilter", "DomainIndex", "PrefixMatcher", "canonicalize", "normalize_host",
+           "url_host", "scan_window"]
+
+# every lookalike folds into a single canonical letter, so the word list never has to be expanded into variants.
+# letters that are commonly swapped for each other (i/l, u/v) share one canonical letter.
+CHARS_MAPPING = {
+    "a": "4аα",
+    "b": "8в",
+    "c": "с",
+    "e": "3еε",
+    "g": "96",
+    "i": "l1іι",
+    "k": "кκ",
+    "o": "0оο",
+    "p": "рρ",
+    "s": "5$ѕ",
+    "t": "7т",
+    "u": "vυν",
+    "x": "х",
+    "y": "уγ",
+}
+# characters that could be one of several letters. these are resolved while matching instead
+WILDCARDS = {
+    "*": "aeiou",
+    "@": "ao",
+}
+ZERO_WIDTH = "\u00ad\u200b\u200c\u200d\u2060\ufeff"
+
+CANONICAL = str.maketrans({
+    **{lookalike: canon for canon, lookalikes in CHARS_MAPPING.items() for lookalike in lookalikes},
+    **{c: None for c in ZERO_WIDTH}
+})
+
+
+def scan_window(text: str, limit: int = None):
+    """
+    the part of the text a matcher should look at: all of it if there's no limit or it's short enough,
+    otherwise its first and last `limit // 2` characters, so padding a message can't push something past the scan
+    """
+    if limit is None or len(text) <= limit:
+        return text
+
+    half = limit // 2
+    # the newline keeps words from being joined across the gap
+    return text[:half] + "\n" + text[-half:]
+
+
+def _is_word_char(c):
+    return c.isalnum() or c == "_"
+
+
+class Automaton:
+    """
+    an aho-corasick automaton.
+    add words to it, then search text for all of them in one pass over the text,
+    no matter how many words have been added.
+    when `boundary` is True, matches only count if they aren't surrounded by other word characters (like regex's \\b).
+    `wildcards` maps characters in the searched text to the other characters they can stand in for,
+    ex. {"*": "aeiou"} lets "f*ck" match a word with any vowel there (or a literal *).
+    changing the words only touches the trie, the failure links are recomputed lazily on the next search.
+    """
+    def __init__(self, words=(), boundary=False, wildcards=None):
+        self.boundary = boundary
+        self.wildcards = wildcards or {}
+        self._words = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._terminal = [None]
+        self._out = [()]
+        self._dirty = False
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        return word in self._words
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __getitem__(self, word):
+        return self._words[word]
+
+    def get(self, word, default=None):
+        return self._words.get(word, default)
+
+    def add(self, word, value=None):
+        """
+        adds a word to the automaton. `value` can be anything, and can be retrieved with `automaton[word]`
+        """
+        if not word:
+            return
+
+        if word not in self._words:
+            goto = self._goto
+            node = 0
+            for char in word:
+                nxt = goto[node].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    self._fail.append(0)
+                    self._terminal.append(None)
+                node = nxt
+
+            self._terminal[node] = word
+            self._dirty = True
+
+        self._words[word] = value
+
+    def remove(self, word):
+        """
+        removes a word from the automaton. raises KeyError if the word isn't in it
+        """
+        del self._words[word]
+        node = 0
+        for char in word:
+            node = self._goto[node][char]
+
+        self._terminal[node] = None
+        self._dirty = True
+
+    def build(self):
+        """
+        computes the failure links. this gets called on the first search after the automaton changes,
+        so you don't have to call it yourself.
+        """
+        goto, fail, terminal = self._goto, self._fail, self._terminal
+        out = [()] * len(goto)
+        queue = collections.deque()
+
+        for node in goto[0].values():
+            fail[node] = 0
+            out[node] = (terminal[node],) if terminal[node] else ()
+            queue.append(node)
+
+        # breadth first, so a node's failure target (which is always shallower) is done before the node itself
+        while queue:
+            node = queue.popleft()
+            for char, nxt in goto[node].items():
+                f = fail[node]
+                while f and char not in goto[f]:
+                    f = fail[f]
+
+                fail[nxt] = goto[f].get(char, 0)
+                own = (terminal[nxt],) if terminal[nxt] else ()
+                out[nxt] = own + out[fail[nxt]]
+                queue.append(nxt)
+
+        self._out = out
+        self._dirty = False
+
+    def iter(self, text):
+        """
+        yields a (start, end, word) tuple for every match in the text, in the order they end.
+        """
+        if self._dirty:
+            self.build()
+
+        if self.wildcards and any(c in text for c in self.wildcards):
+            yield from self._iter_wildcards(text)
+            return
+
+        goto, fail, out = self._goto, self._fail, self._out
+        boundary = self.boundary
+        length = len(text)
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            if out[state]:
+                end = index + 1
+                for word in out[state]:
+                    start = end - len(word)
+                    if boundary and ((start and _is_word_char(text[start - 1])) or
+                                     (end < length and _is_word_char(text[end]))):
+                        continue
+
+                    yield start, end, word
+
+    def _iter_wildcards(self, text):
+        # a wildcard can take several paths through the automaton, so track every state we could be in.
+        # states are deduplicated, so this is bounded by the size of the automaton, not the amount of wildcards
+        goto, fail, out = self._goto, self._fail, self._out
+        boundary, wildcards = self.boundary, self.wildcards
+        length = len(text)
+        states = {0}
+        for index, char in enumerate(text):
+            nxt = set()
+            for state in states:
+                for c in (char + wildcards[char] if char in wildcards else char):
+                    s = state
+                    while s and c not in goto[s]:
+                        s = fail[s]
+                    nxt.add(goto[s].get(c, 0))
+
+            states = nxt
+            end = index + 1
+            found = set()
+            for state in states:
+                for word in out[state]:
+                    if word in found:
+                        continue
+
+                    found.add(word)
+                    start = end - len(word)
+                    if boundary and ((start and _is_word_char(text[start - 1])) or
+                                     (end < length and _is_word_char(text[end]))):
+                        continue
+
+                    yield start, end, word
+
+    def search(self, text):
+        """
+        returns the first (start, end, word) match in the text, or None
+        """
+        return next(self.iter(text), None)
+
+
+def canonicalize(text: str):
+    """
+    maps text to its canonical form: lowercase, no accents, no zero width characters, lookalikes replaced,
+    and runs of the same letter collapsed into one.
+    returns the canonical text, and how long each of its characters' runs were in the original text
+    """
+    text = text.casefold()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+    text = text.translate(CANONICAL)
+    chars = []
+    runs = []
+    for char, group in itertools.groupby(text):
+        amount = sum(1 for _ in group)
+        if char in WILDCARDS:
+            # each wildcard stands in for its own letter, so they don't collapse
+            chars.append(char * amount)
+            runs.extend([1] * amount)
+        else:
+            chars.append(char)
+            runs.append(amount)
+
+    return "".join(chars), runs
+
+class WordFilter:
+    """
+    matches words against canonicalized text.
+    letters can be stretched ("shiiit" matches "shit"), but not shortened ("as" won't match "ass")
+    """
+    def __init__(self, words=()):
+        self.automaton = Automaton(boundary=True, wildcards=WILDCARDS)
+        # kept up to date by add/remove, automod checks the filter's truthiness on every message
+        self._count = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for key in self.automaton:
+            yield from self.automaton[key]
+
+    def __contains__(self, word):
+        key, _ = canonicalize(word.strip())
+        return key in self.automaton and word.strip() in self.automaton[key]
+
+    def add(self, word: str):
+        word = word.strip()
+        key, runs = canonicalize(word)
+        if not key:
+            return
+
+        entry = self.automaton.get(key)
+        if entry is None:
+            entry = {}
+            self.automaton.add(key, entry)
+
+        if word not in entry:
+            self._count += 1
+
+        entry[word] = tuple(runs)
+
+    def remove(self, word: str):
+        word = word.strip()
+        key, _ = canonicalize(word)
+        entry = self.automaton.get(key)
+        if entry is None or word not in entry:
+            raise ValueError(f"{word} is not in the filter")
+
+        del entry[word]
+        self._count -= 1
+        if not entry:
+            self.automaton.remove(key)
+
+    def match(self, text: str, runs: list):
+        """
+        searches text that has already been passed through `canonicalize`.
+        returns the (start, end, word) of the first match, or None
+        """
+        for start, end, key in self.automaton.iter(text):
+            have = runs[start:end]
+            for word, need in self.automaton[key].items():
+                if all(h >= n for h, n in zip(have, need)):
+                    return start, end, word
+
+        return None
+
+    def search(self, content: str):
+        return self.match(*canonicalize(content))
+
+
+def url_host(url: str):
+    """
+    the host of a url, or None if there isn't one or the url can't be parsed (ex. "http://[x")
+    """
+    try:
+        return yarl.URL(url).host
+    except ValueError:
+        return None
+
+
+def normalize_host(host: str):
+    """
+    lowercases a hostname, drops the trailing dot, and encodes unicode labels as punycode,
+    so "EXAMPLE.com.", "example.com" and their unicode lookalikes compare the same way
+    """
+    host = host.strip().rstrip(".").lower()
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+
+    return host
+
+
+class DomainIndex:
+    """
+    a trie of domains, keyed by their labels in reverse ("com", "example", "www").
+    entries can be:
+    - `example.com`: blocks example.com and all of its subdomains
+    - `*.example.com`: blocks the subdomains of example.com, but not example.com itself
+    - `!example.com` / `!*.example.com`: allows them again, even if a parent domain is blocked
+    the most specific entry wins. looking up a host takes one step per label, no matter how many entries there are.
+    """
+    EXACT = 0
+    SUBTREE = 1
+
+    def __init__(self, entries=()):
+        self._root = {}
+        self._entries = set()
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(sorted(self._entries))
+
+    def __contains__(self, entry):
+        return self.parse(entry) in self._entries
+
+    @staticmethod
+    def parse(text: str):
+        """
+        turns user input (a domain or a url, optionally starting with `!` and/or `*.`) into an entry.
+        returns None if there's no domain in it
+        """
+        text = text.strip()
+        allow = text.startswith("!")
+        if allow:
+            text = text[1:].strip()
+
+        wildcard = text.startswith("*.")
+        if wildcard:
+            text = text[2:]
+
+        if "://" not in text:
+            text = "http://" + text
+
+        host = url_host(text)
+        if not host:
+            return None
+
+        return ("!" if allow else "") + ("*." if wildcard else "") + normalize_host(host)
+
+    @staticmethod
+    def _split(entry: str):
+        allow = entry.startswith("!")
+        if allow:
+            entry = entry[1:]
+
+        wildcard = entry.startswith("*.")
+        if wildcard:
+            entry = entry[2:]
+
+        return allow, wildcard, entry
+
+    def _node(self, domain: str, create: bool):
+        node = self._root
+        for label in reversed(domain.split(".")):
+            child = node.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = node[label] = {}
+            node = child
+
+        return node
+
+    def _apply(self, domain: str):
+        # recompute the rules for one domain from whichever of its entries exist. allow entries win over blocks
+        node = self._node(domain, True)
+        node.pop(self.EXACT, None)
+        node.pop(self.SUBTREE, None)
+        for entry in (domain, "*." + domain, "!" + domain, "!*." + domain):
+            if entry not in self._entries:
+                continue
+
+            allow, wildcard, _ = self._split(entry)
+            if not wildcard:
+                node[self.EXACT] = entry
+            node[self.SUBTREE] = entry
+
+    def add(self, entry: str):
+        entry = self.parse(entry)
+        if entry is None:
+            raise ValueError("That isn't a valid domain")
+
+        self._entries.add(entry)
+        self._apply(self._split(entry)[2])
+        return entry
+
+    def remove(self, entry: str):
+        parsed = self.parse(entry)
+        if parsed not in self._entries:
+            raise ValueError(f"{entry} is not in the index")
+
+        self._entries.discard(parsed)
+        self._apply(self._split(parsed)[2])
+        return parsed
+
+    def search(self, host: str):
+        """
+        returns the entry that blocks this host, or None if it isn't blocked (or is explicitly allowed)
+        """
+        if not self._entries or not host:
+            return None
+
+        labels = normalize_host(host).split(".")
+        node = self._root
+        found = None
+        # walk from the tld down, so deeper (more specific) entries overwrite the ones above them
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                break
+
+            rule = node.get(self.SUBTREE if i else self.EXACT)
+            if rule is not None:
+                found = rule
+
+        if found is None or found.startswith("!"):
+            return None
+
+        return found
+
+
+class PrefixMatcher:
+    """
+    an immutable set of command prefixes. prefixes are checked longest first,
+    so "!!" wins over "!" no matter which was added first, and only the prefixes
+    starting with the message's first character are looked at.
+    `owner` prefixes only match when `match` is told the author is an owner.
+    build a new one when the prefixes change.
+    """
+    __slots__ = ("prefixes", "owner_prefixes", "_buckets", "_owner_buckets")
+
+    def __init__(self, prefixes=(), owner=()):
+        self.prefixes = self._sort(prefixes)
+        self.owner_prefixes = self._sort((*prefixes, *owner))
+        self._buckets = self._bucket(self.prefixes)
+        self._owner_buckets = self._bucket(self.owner_prefixes)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __iter__(self):
+        return iter(self.prefixes)
+
+    @staticmethod
+    def _sort(prefixes):
+        return tuple(sorted(set(prefixes), key=len, reverse=True))
+
+    @staticmethod
+    def _bucket(prefixes):
+        buckets = {}
+        for prefix in prefixes:
+            # an empty prefix matches everything, so it goes at the end of every bucket
+            buckets.setdefault(prefix[:1], [])
+
+        for prefix in prefixes:
+            if prefix:
+                buckets[prefix[0]].append(prefix)
+            else:
+                for bucket in buckets.values():
+                    bucket.append(prefix)
+
+        return {first: tuple(bucket) for first, bucket in buckets.items()}
+
+    def get(self, owner=False):
+        """
+        every prefix, longest first
+        """
+        return self.owner_prefixes if owner else self.prefixes
+
+    def match(self, content: str, owner=False):
+        """
+        the longest prefix the content starts with, or None
+        """
+        buckets = self._owner_buckets if owner else self._buckets
+        for prefix in buckets.get(content[:1]) or buckets.get("", ()):
+            if content.startswith(prefix):
+                return prefix
+
+        return None
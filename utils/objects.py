@@ -1,3 +1,4 @@
+import collections.abc
 import enum
 import wavelink
 import asyncio
@@ -6,6 +7,8 @@ import itertools
 import random
 import discord
 
+from .matchers import DomainIndex, WordFilter
+
 class OP(enum.IntEnum):
     DISCONNECT = 1
     DISPATCH = 2
@@ -50,13 +53,12 @@ class AutomodLevels:
         self.raidmode = raidmode
         self.flags = list(flags)
         self.channel = channel
-        self.bad_words = bad_words or []
+        self.bad_words = WordFilter(bad_words or ())
         self.default_filter = default_filter
         self.caps_percent = caps_percent
-        self.blacklisted_links = []
+        self.blacklisted_links = DomainIndex()
         self.ignored_channels = ignored_channels or []
         self.ignores_roles = ignored_roles or []
-        self.regex = None
 
     def save(self):
         return self.value, self.raidmode, self.channel, self.caps_percent, self.default_filter
@@ -69,6 +71,14 @@ class AutomodLevels:
     def all(cls):
         return cls("3333333", 3, None, True, None, 50, None, None)
 
+    def snapshot(self):
+        return list(self.flags), self.raidmode, self.default_filter
+
+    def restore(self, snapshot):
+        flags, self.raidmode, self.default_filter = snapshot
+        self.flags = list(flags)
+        return self
+
     def raidmode_strict(self):
         self.words = 2
         self.invites = 3
@@ -150,6 +160,18 @@ class AutomodLevels:
     def words(self, value: int):
         self.flags[6] = str(value)
 
+    @property
+    def auto_raidmode(self):
+        # added after the other flags, older rows don't have it
+        return int(self.flags[7]) if len(self.flags) > 7 else 0
+
+    @auto_raidmode.setter
+    def auto_raidmode(self, value: int):
+        if len(self.flags) < 8:
+            self.flags += ["0"] * (8 - len(self.flags))
+
+        self.flags[7] = str(value)
+
 class flag_value:
     def __init__(self, func):
         self.flag = func(None)
@@ -251,52 +273,228 @@ class LoggingFlags:
     def emojis_update(self):
         return 1 << 14
 
-def load_modules(record):
-    flags = record['flags']
-    def _i(flag):
-        return bool(int(flag))
-    v = {
-        "moderation": _i(flags[0]),
-        "quotes": _i(flags[1]),
-        "automod": _i(flags[2]),
-        "modlogs": _i(flags[3]),
-        "community": _i(flags[4]),
-        "fun": _i(flags[5]),
-        "music": _i(flags[6]),
-        "autoresponder": _i(flags[7]),
-        "misc": _i(flags[8]),
-        "events": _i(flags[9]),
-        "currency": _i(flags[10]),
-        "modmail": _i(flags[11]),
-        "basics": _i(flags[12]),
-        "commands": _i(flags[13]),
-        "tags": _i(flags[14]),
-        "highlight": _i(flags[15])
-    }
-    return v
-
-def save_modules(d, default=True):
-    resp = ""
-    def _i(mod):
-        return str(int(d.get(mod, default)))
-    resp += _i("moderation")
-    resp += _i("quotes")
-    resp += _i("automod")
-    resp += _i("modlogs")
-    resp += _i("community")
-    resp += _i("fun")
-    resp += _i("music")
-    resp += _i("autoresponder")
-    resp += _i("misc")
-    resp += _i("events")
-    resp += _i("currency")
-    resp += _i("modmail")
-    resp += _i("basics")
-    resp += _i("commands")
-    resp += _i("tags")
-    resp += _i("moderation")
-    resp += _i("highlight")
-    return resp
+MODULES = (
+    "moderation",
+    "quotes",
+    "automod",
+    "modlogs",
+    "community",
+    "fun",
+    "music",
+    "autoresponder",
+    "misc",
+    "events",
+    "currency",
+    "modmail",
+    "basics",
+    "commands",
+    "tags",
+    "highlight"
+)
+ALL_MODULES = (1 << len(MODULES)) - 1
+# the order modules are stored in the `flags` string of the modules table. moderation is stored twice, don't ask
+_FLAGS_ORDER = MODULES[:15] + ("moderation", "highlight")
+
+
+def _module_bit(name):
+    return 1 << MODULES.index(name)
+
+def modules_from_flags(flags: str) -> int:
+    """
+    turns the `flags` string from the modules table into a module bitmask
+    """
+    modules = 0
+    for index, (name, flag) in enumerate(zip(_FLAGS_ORDER, flags)):
+        # the second moderation flag is just a copy
+        if flag == "1" and _FLAGS_ORDER.index(name) == index:
+            modules |= _module_bit(name)
+
+    # strings saved before highlight existed don't have a flag for it
+    if len(flags) < len(_FLAGS_ORDER):
+        modules |= _module_bit("highlight")
+
+    return modules
+
+def flags_from_modules(modules: int) -> str:
+    """
+    turns a module bitmask back into a `flags` string for the modules table
+    """
+    return "".join("1" if modules & _module_bit(name) else "0" for name in _FLAGS_ORDER)
+
+
+class GuildConfig:
+    """
+    everything the bot keeps about one guild's configuration, in one place.
+    configs are never changed in place. use `replace` to make a changed copy, and swap it in with `bot.update_config`,
+    so anything holding onto a config always sees a consistent one.
+    the automod and logging states are objects of their own, which their cogs do change in place.
+    """
+    __slots__ = ("guild_id", "modules", "prefixes", "editor", "muted", "moderator", "manager", "automod", "logging")
+
+    ROLES = ("editor", "muted", "moderator", "manager")
+
+    def __init__(self, guild_id: int, modules: int = ALL_MODULES, prefixes=(), editor=None, muted=None,
+                 moderator=None, manager=None, automod=None, logging=None):
+        self.guild_id = guild_id
+        self.modules = modules
+        self.prefixes = tuple(prefixes)
+        self.editor = editor
+        self.muted = muted
+        self.moderator = moderator
+        self.manager = manager
+        self.automod = automod # type: AutomodLevels
+        self.logging = logging # type: LoggingFlags
+
+    def __repr__(self):
+        return f"<GuildConfig guild_id={self.guild_id} modules={self.modules:#x} prefixes={self.prefixes}>"
+
+    @classmethod
+    def from_record(cls, db, record):
+        """
+        builds a config from a row of the guild config query (see `GuildConfig.QUERY`)
+        """
+        logging = None
+        if record['log_guild'] is not None:
+            logging = LoggingFlags(db, {"guild_id": record['guild_id'], "flags": record['log_flags'], "channel": record['log_channel']})
+
+        return cls(record['guild_id'],
+                   modules_from_flags(record['flags']) if record['flags'] is not None else ALL_MODULES,
+                   record['prefixes'] or (),
+                   record['editor'],
+                   record['muted'],
+                   record['moderator'],
+                   record['manager'],
+                   logging=logging)
+
+    # every guild that has any config, with all of it joined together
+    QUERY = """
+    SELECT g.guild_id, m.flags, r.guild_id AS roles_guild, r.editor, r.muted, r.moderator, r.manager,
+           l.guild_id AS log_guild, l.flags AS log_flags, l.channel AS log_channel,
+           ARRAY(SELECT p.prefix FROM prefixes p WHERE p.guild_id = g.guild_id) AS prefixes
+    FROM (SELECT guild_id FROM modules UNION SELECT guild_id FROM roles UNION SELECT guild_id FROM prefixes
+          UNION SELECT guild_id FROM modlogs) g
+    LEFT JOIN modules m ON m.guild_id = g.guild_id
+    LEFT JOIN roles r ON r.guild_id = g.guild_id
+    LEFT JOIN modlogs l ON l.guild_id = g.guild_id;
+    """
+
+    def replace(self, **changes):
+        """
+        a copy of this config, with some attributes changed
+        """
+        attrs = {attr: getattr(self, attr) for attr in self.__slots__}
+        attrs.update(changes)
+        return self.__class__(**attrs)
+
+    def has_module(self, name: str) -> bool:
+        return bool(self.modules & _module_bit(name))
+
+    def module_mask(self, name: str, state: bool) -> int:
+        """
+        the module bitmask with one module turned on or off, for `bot.update_config(guild_id, modules=...)`
+        """
+        bit = _module_bit(name)
+        return self.modules | bit if state else self.modules & ~bit
+
+    def module_states(self) -> dict:
+        return {name: self.has_module(name) for name in MODULES}
+
+    def role(self, name: str):
+        """
+        the id of one of the guild's configured ROLES, or None
+        """
+        return getattr(self, name)
+
+    def roles(self) -> dict:
+        return {name: getattr(self, name) for name in self.ROLES}
+
+
+class GuildConfigs(dict):
+    """
+    a dict of guild id: GuildConfig, that keeps count of how many configs have each of the VIEWED attributes set,
+    so GuildConfigView doesn't have to go through every guild to know its length
+    """
+    VIEWED = ("automod", "logging")
+
+    def __init__(self):
+        super().__init__()
+        self.counts = dict.fromkeys(self.VIEWED, 0)
+
+    def _count(self, config, delta):
+        if config is None:
+            return
+
+        for attr in self.VIEWED:
+            if getattr(config, attr) is not None:
+                self.counts[attr] += delta
+
+    def __setitem__(self, guild_id, config):
+        self._count(self.get(guild_id), -1)
+        super().__setitem__(guild_id, config)
+        self._count(config, 1)
+
+    def __delitem__(self, guild_id):
+        self._count(self[guild_id], -1)
+        super().__delitem__(guild_id)
+
+    def pop(self, guild_id, *default):
+        if guild_id not in self:
+            return super().pop(guild_id, *default)
+
+        config = super().pop(guild_id)
+        self._count(config, -1)
+        return config
+
+    def popitem(self):
+        guild_id, config = super().popitem()
+        self._count(config, -1)
+        return guild_id, config
+
+    def setdefault(self, guild_id, config=None):
+        if guild_id not in self:
+            self[guild_id] = config
+
+        return self[guild_id]
+
+    def update(self, *args, **kwargs):
+        for guild_id, config in dict(*args, **kwargs).items():
+            self[guild_id] = config
+
+    def clear(self):
+        super().clear()
+        self.counts = dict.fromkeys(self.VIEWED, 0)
+
+
+class GuildConfigView(collections.abc.MutableMapping):
+    """
+    a dict of guild id: one attribute of each GuildConfig, ex. `automod`.
+    guilds where the attribute is None count as missing. setting a guild's value swaps in a new config for it.
+    """
+    def __init__(self, configs: GuildConfigs, attr: str):
+        self._configs = configs
+        self._attr = attr
+
+    def __getitem__(self, guild_id):
+        value = getattr(self._configs[guild_id], self._attr)
+        if value is None:
+            raise KeyError(guild_id)
+
+        return value
+
+    def __setitem__(self, guild_id, value):
+        config = self._configs.get(guild_id) or GuildConfig(guild_id)
+        self._configs[guild_id] = config.replace(**{self._attr: value})
+
+    def __delitem__(self, guild_id):
+        self[guild_id] # raises KeyError if it isn't set
+        self[guild_id] = None
+
+    def __iter__(self):
+        return (gid for gid, config in list(self._configs.items()) if getattr(config, self._attr) is not None)
+
+    def __len__(self):
+        return self._configs.counts[self._attr]
+
 
 class Track(wavelink.Track):
     __slots__ = ('requester', 'channel', 'message')
@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+
+__all__ = ["DueQueue"]
+
+
+class DueQueue:
+    """
+    a min-heap of things that are due at some point (unix timestamps), with one task that sleeps until the earliest one.
+    when items come due, they're handed to `callback(items)` together, as a list of (key, item) tuples.
+    scheduling or cancelling is O(log n), and nothing runs while nothing is due.
+    each key is only scheduled once: scheduling it again replaces it, and `cancel` drops it.
+    the sleep is capped at `max_sleep` seconds, so a clock jump can't leave things waiting forever.
+    """
+    def __init__(self, callback, max_sleep: float = 3600, loop=None):
+        self.callback = callback
+        self.max_sleep = max_sleep
+        self.loop = loop or asyncio.get_event_loop()
+        self.fired = 0
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def next_due(self):
+        """
+        when the earliest item is due, or None if nothing is scheduled
+        """
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    def schedule(self, key, due: float, item=None):
+        old = self._entries.get(key)
+        if old is not None:
+            # the old entry stays in the heap as a tombstone, and is skipped once it reaches the top
+            old[2] = None
+
+        entry = [due, next(self._counter), key, item]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # it's the new earliest, the runner needs to sleep less than it is
+            self._wake.set()
+
+    def cancel(self, key) -> bool:
+        """
+        drops a scheduled item. returns False if it wasn't scheduled
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+
+        # left in the heap, and skipped once it reaches the top
+        entry[2] = None
+        return True
+
+    def _prune(self):
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+
+    def _pop_due(self, now):
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            key = entry[2]
+            if key is None or self._entries.get(key) is not entry:
+                continue
+
+            del self._entries[key]
+            due.append((key, entry[3]))
+
+        return due
+
+    async def _run(self):
+        while True:
+            self._prune()
+            self._wake.clear()
+            if self._heap:
+                wait = min(self._heap[0][0] - time.time(), self.max_sleep)
+            else:
+                wait = self.max_sleep
+
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                due = self._pop_due(time.time())
+                if not due:
+                    continue
+
+                self.fired += len(due)
+                await self.callback(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
@@ -0,0 +1,289 @@
+import collections
+import time
+
+__all__ = ["TimestampRing", "SpamTracker", "JoinTracker", "RuleBudget"]
+
+
+class TimestampRing:
+    """
+    a fixed size ring of timestamps.
+    memory doesn't grow with traffic, and checking "n events in x seconds" is a single index lookup
+    """
+    __slots__ = ("times", "extra", "size", "count", "_next")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.times = [0.0] * size
+        self.extra = [None] * size
+        self.count = 0
+        self._next = 0
+
+    def push(self, now: float, extra=None):
+        self.times[self._next] = now
+        self.extra[self._next] = extra
+        self._next = (self._next + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def within(self, amount: int, per: float, now: float) -> bool:
+        """
+        whether the last `amount` entries all happened in the last `per` seconds
+        """
+        if amount > self.count:
+            return False
+
+        return self.times[(self._next - amount) % self.size] > now - per
+
+    def recent(self, per: float, now: float):
+        """
+        yields the (timestamp, extra) of entries from the last `per` seconds, newest first
+        """
+        for i in range(1, self.count + 1):
+            index = (self._next - i) % self.size
+            if self.times[index] <= now - per:
+                return
+
+            yield self.times[index], self.extra[index]
+
+    @property
+    def newest(self) -> float:
+        if not self.count:
+            return 0.0
+
+        return self.times[(self._next - 1) % self.size]
+
+    def clear(self):
+        self.count = 0
+        self._next = 0
+
+
+class SpamTracker:
+    """
+    tracks how fast each user in each guild is sending messages.
+    `rules` are (amount, per) pairs, ex. (8, 4) is 8 messages in 4 seconds. the first rule to trigger is reported.
+    `duplicates` is an (amount, per) pair for the same content being sent over and over, in any channel.
+    messages shorter than `min_length` aren't checked for duplicates, so people can say "lol" as much as they want.
+    users that haven't talked for `idle` seconds get evicted when `evict` is called.
+    """
+    def __init__(self, rules=((8, 4), (25, 15)), duplicates=(4, 30), min_length=10, idle=60):
+        self.rules = rules
+        self.duplicates = duplicates
+        self.min_length = min_length
+        self.idle = max(idle, *(per for _, per in rules), duplicates[1])
+        self.size = max(amount for amount, _ in rules)
+        self._users = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def hit(self, message, now: float = None):
+        """
+        records a message. returns a (reason, amount of messages to purge) tuple if the author is spamming, otherwise None.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        key = message.guild.id, message.author.id
+        ring = self._users.get(key)
+        if ring is None:
+            ring = self._users[key] = TimestampRing(self.size)
+
+        digest = hash(message.content.casefold()) if len(message.content) >= self.min_length else None
+        ring.push(now, digest)
+
+        for amount, per in self.rules:
+            if ring.within(amount, per, now):
+                ring.clear()
+                return f"Sent {amount} messages in {per} seconds", amount
+
+        if digest is not None:
+            amount, per = self.duplicates
+            if sum(1 for _, d in ring.recent(per, now) if d == digest) >= amount:
+                ring.clear()
+                return f"Sent the same message {amount} times in {per} seconds", amount
+
+        return None
+
+    def evict(self, now: float = None) -> int:
+        """
+        forgets users that haven't sent anything recently. returns how many were removed
+        """
+        if now is None:
+            now = time.monotonic()
+
+        cutoff = now - self.idle
+        stale = [key for key, ring in self._users.items() if ring.newest <= cutoff]
+        for key in stale:
+            del self._users[key]
+
+        return len(stale)
+
+
+class JoinTracker:
+    """
+    tracks how fast members are joining each guild, and how old their accounts are.
+    a guild is being raided when `amount` members join within `per` seconds, or when `young_amount`
+    of the accounts that joined within `young_per` seconds are less than a day old.
+    nothing here touches the database, so it can keep up with thousands of joins a minute.
+    """
+    # upper edges of the account age histogram, in seconds: an hour, a day, a week, a month, and everything older
+    AGE_BUCKETS = (3600, 86400, 604800, 2592000)
+
+    def __init__(self, amount=10, per=10, young_amount=5, young_per=60, idle=600):
+        self.amount = amount
+        self.per = per
+        self.young_amount = young_amount
+        self.young_per = young_per
+        self.idle = max(idle, per, young_per)
+        self.size = max(amount, young_amount * 2)
+        self._guilds = {}
+
+    def _bucket(self, age: float) -> int:
+        for index, edge in enumerate(self.AGE_BUCKETS):
+            if age < edge:
+                return index
+
+        return len(self.AGE_BUCKETS)
+
+    def hit(self, member, age: float, now: float = None):
+        """
+        records a join. `age` is how old the member's account is, in seconds.
+        returns the reason if the guild looks like it's being raided, otherwise None
+        """
+        if now is None:
+            now = time.monotonic()
+
+        ring = self._guilds.get(member.guild.id)
+        if ring is None:
+            ring = self._guilds[member.guild.id] = TimestampRing(self.size)
+
+        ring.push(now, self._bucket(age))
+
+        if ring.within(self.amount, self.per, now):
+            return f"{self.amount} members joined within {self.per} seconds"
+
+        # 0 and 1 are the "under an hour" and "under a day" buckets
+        young = sum(1 for _, bucket in ring.recent(self.young_per, now) if bucket <= 1)
+        if young >= self.young_amount:
+            return f"{young} accounts less than a day old joined within {self.young_per} seconds"
+
+        return None
+
+    def histogram(self, guild_id: int, per: float = None, now: float = None) -> list:
+        """
+        how many of the recent joins fall into each of the AGE_BUCKETS (plus one for older accounts)
+        """
+        if now is None:
+            now = time.monotonic()
+
+        counts = [0] * (len(self.AGE_BUCKETS) + 1)
+        ring = self._guilds.get(guild_id)
+        if ring is not None:
+            for _, bucket in ring.recent(per or self.young_per, now):
+                counts[bucket] += 1
+
+        return counts
+
+    def evict(self, now: float = None) -> int:
+        """
+        forgets guilds nobody has joined recently. returns how many were removed
+        """
+        if now is None:
+            now = time.monotonic()
+
+        cutoff = now - self.idle
+        stale = [key for key, ring in self._guilds.items() if ring.newest <= cutoff]
+        for key in stale:
+            del self._guilds[key]
+
+        return len(stale)
+
+
+class RuleBudget:
+    """
+    keeps track of how long message rules take to run, since they all run on the event loop.
+    a run longer than `budget` seconds counts as an overrun. `overruns` counts them per rule, for the stats command.
+    if a rule overruns `trips` times within `per` seconds in one guild, it's degraded there for `cooldown` seconds:
+    it still runs on every message, but only scans the first and last `degraded_length` characters (see scan_window).
+    that way one guild sending crafted messages can't keep the heartbeat waiting, and can't switch the rule off either.
+    """
+    def __init__(self, budget=0.005, trips=3, per=60, cooldown=300, degraded_length=256):
+        self.budget = budget
+        self.trips = trips
+        self.per = per
+        self.cooldown = cooldown
+        self.degraded_length = degraded_length
+        self.overruns = collections.Counter()
+        self.degraded_runs = collections.Counter()
+        self._rings = {}
+        self._tripped = {}
+
+    def scan_length(self, guild_id: int, rule: str, now: float = None):
+        """
+        how many characters the rule should scan in the guild right now, or None if it isn't degraded and can scan everything
+        """
+        if not self._tripped:
+            return None
+
+        until = self._tripped.get((guild_id, rule))
+        if until is None:
+            return None
+
+        if now is None:
+            now = time.monotonic()
+
+        if now >= until:
+            del self._tripped[(guild_id, rule)]
+            return None
+
+        self.degraded_runs[rule] += 1
+        return self.degraded_length
+
+    def record(self, guild_id: int, rule: str, elapsed: float, now: float = None) -> bool:
+        """
+        records how long a rule took. returns True if this run degraded the rule in the guild
+        """
+        if elapsed <= self.budget:
+            return False
+
+        if now is None:
+            now = time.monotonic()
+
+        self.overruns[rule] += 1
+        key = guild_id, rule
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = TimestampRing(self.trips)
+
+        ring.push(now)
+        if not ring.within(self.trips, self.per, now):
+            return False
+
+        del self._rings[key]
+        self._tripped[key] = now + self.cooldown
+        return True
+
+    def drop(self, guild_id: int):
+        """
+        forgets everything about a guild, ex. when the bot leaves it
+        """
+        for mapping in (self._rings, self._tripped):
+            for key in [key for key in mapping if key[0] == guild_id]:
+                del mapping[key]
+
+    def evict(self, now: float = None) -> int:
+        """
+        forgets overruns too old to trip anything, and degradations that have run out. returns how many were removed
+        """
+        if now is None:
+            now = time.monotonic()
+
+        stale = [key for key, ring in self._rings.items() if ring.newest <= now - self.per]
+        for key in stale:
+            del self._rings[key]
+
+        expired = [key for key, until in self._tripped.items() if until <= now]
+        for key in expired:
+            del self._tripped[key]
+
+        return len(stale) + len(expired)